@@ -0,0 +1,207 @@
+###########################################################
+# This script creates weekly opioid prescribing rates
+#   in the 6 months pre-waiting list, during waiting list and
+#   12 months post-waiting list, aligned to each person's
+#   waiting list dates, from the prescriptions extracted by
+#   dataset_definition_opioid_rx.py
+#
+# Each Rx is placed in a week relative to its period's anchor
+#   (RTT start, RTT end + 1 day, or RTT start - 182 days), and
+#   each person counts in the denominator up to the last week
+#   they are still waiting/uncensored - the same numerators and
+#   denominators as measures_opioid_all.py, in one pass.
+#
+# Output has the same format as ehrQL measures (each week is
+#   an interval starting from 2000-01-01), so it can be read
+#   by opioids_by_week.R. Options for a smaller output:
+#   --sparse: omit cells with no one at risk (denominator 0)
+#   --num-weeks-bands: group by bands of num_weeks (e.g. 18 52
+#     gives <=18, 19-52 and >52 weeks) instead of every value
+#   --format parquet: Parquet, with the measure, codelist and
+#     any text group columns dictionary-encoded
+###########################################################
+
+import datetime
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from helpers import person_rows, read_arrow
+
+
+# Start of the first interval of every measure (week 1)
+INTERVAL_START = datetime.date(2000, 1, 1)
+
+DEFAULT_GROUP_BY = ["prior_opioid_rx", "num_weeks", "oa_diagnosis", "hip_hrg", "knee_hrg"]
+
+
+# Measure periods: name -> (number of weeks, anchor day, at-risk days), where
+#   the anchor is day 0 of week 1 (in days from RTT start), and a person is
+#   in the denominator for week k (from 0) if at-risk days > 7k + 6
+#   (None = every week). Both are functions of the per-person columns.
+PERIODS = {
+    # During WL - from RTT start, while still on the WL and not censored
+    "wait": (
+        52,
+        lambda people: 0,
+        lambda people: np.minimum(people["end_days"], people["wait_days"]),
+    ),
+    # Post WL - from the day after RTT end, while not censored
+    #   (censoring date compared with RTT end, as in measures_opioid_all.py)
+    "post": (
+        52,
+        lambda people: people["wait_days"] + 1,
+        lambda people: people["end_days"] - people["wait_days"],
+    ),
+    # Pre WL - from 182 days before RTT start
+    "pre": (
+        26,
+        lambda people: -182,
+        None,
+    ),
+}
+
+
+def weeks_at_risk(at_risk_days, num_weeks):
+    """Weeks each person is in the denominator for.
+
+    Week k (from 0) ends on day 7k + 6, and a person is at risk in it if
+    at_risk_days > 7k + 6, i.e. for the first at_risk_days // 7 weeks."""
+    return np.clip(at_risk_days // 7, 0, num_weeks)
+
+
+def period_counts(rx_day, rx_person, people, group_id, num_groups, num_weeks, anchor, at_risk):
+    """Denominator per (group, week), and the (group, week) cell of every
+    Rx which counts towards the numerator (-1 if it doesn't count)."""
+    if at_risk is None:
+        person_weeks = np.full(len(group_id), num_weeks)
+    else:
+        person_weeks = weeks_at_risk(at_risk(people), num_weeks)
+
+    # Denominator: people at risk for more than k weeks, per group
+    at_risk_counts = np.bincount(
+        group_id * (num_weeks + 1) + person_weeks, minlength=num_groups * (num_weeks + 1)
+    ).reshape(num_groups, num_weeks + 1)
+    denominator = np.cumsum(at_risk_counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    # Numerator: Rx in a week the person is at risk for
+    day = rx_day - (np.broadcast_to(anchor(people), group_id.shape)[rx_person])
+    week = np.floor_divide(day, 7)
+    counts = (day >= 0) & (week < person_weeks[rx_person])
+    cell = np.where(counts, group_id[rx_person] * num_weeks + week, -1)
+
+    return denominator, cell
+
+
+def band_num_weeks(num_weeks, bands):
+    """num_weeks as categories, given the upper limit of each band
+    (the last band has no upper limit)."""
+    labels = (
+        [f"<={bands[0]} weeks"]
+        + [f"{lower + 1}-{upper} weeks" for lower, upper in zip(bands, bands[1:])]
+        + [f">{bands[-1]} weeks"]
+    )
+    return pd.cut(num_weeks, [-np.inf, *bands, np.inf], labels=labels)
+
+
+def aligned_measures(people, prescriptions, codelist_names, group_by, sparse=False):
+    people = people.sort_values("patient_id").reset_index(drop=True)
+    rx_person = person_rows(people["patient_id"].to_numpy(), prescriptions["patient_id"].to_numpy())
+    rx_day = prescriptions["rx_day"].to_numpy(dtype=np.int64)
+    days = {column: people[column].to_numpy(dtype=np.int64) for column in ["wait_days", "end_days"]}
+
+    grouped = people.groupby(group_by, dropna=False, sort=True, observed=True)
+    group_id = grouped.ngroup().to_numpy()
+    groups = grouped.size().index.to_frame(index=False)
+    num_groups = len(groups)
+
+    periods = {}
+    for period, (num_weeks, anchor, at_risk) in PERIODS.items():
+        periods[period] = period_counts(
+            rx_day, rx_person, days, group_id, num_groups, num_weeks, anchor, at_risk
+        )
+
+    results = []
+    for codelist_name in codelist_names:
+        in_codelist = prescriptions[codelist_name].fillna(False).to_numpy(dtype=bool)
+
+        for period, (num_weeks, _, _) in PERIODS.items():
+            denominator, cell = periods[period]
+            numerator = np.bincount(
+                cell[in_codelist & (cell >= 0)], minlength=num_groups * num_weeks
+            ).reshape(num_groups, num_weeks)
+
+            # Cells to keep (with --sparse, only those with anyone at risk)
+            keep = denominator.ravel() > 0 if sparse else np.ones(num_groups * num_weeks, dtype=bool)
+
+            interval_start = [INTERVAL_START + datetime.timedelta(weeks=week) for week in range(num_weeks)]
+            result = pd.DataFrame({
+                "measure": f"count_{period}_{codelist_name}",
+                "interval_start": np.tile(interval_start, num_groups)[keep],
+                "interval_end": np.tile([start + datetime.timedelta(days=6) for start in interval_start],
+                                        num_groups)[keep],
+                "numerator": numerator.ravel()[keep],
+                "denominator": denominator.ravel()[keep],
+                "codelist": codelist_name,
+            })
+            result["ratio"] = result["numerator"] / result["denominator"].where(result["denominator"] > 0)
+            group_values = groups.loc[groups.index.repeat(num_weeks)[keep]].reset_index(drop=True)
+            results.append(pd.concat([result, group_values], axis=1))
+
+    measures = pd.concat(results, ignore_index=True)
+    return measures[["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator",
+                     "codelist", *group_by]]
+
+
+def write_measures_csv(measures, output_path):
+    # Booleans as T/F, the same as ehrQL measures output
+    measures = measures.copy()
+    for column in measures.columns:
+        if measures[column].dtype == bool:
+            measures[column] = measures[column].map({True: "T", False: "F"})
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    measures.to_csv(output_path, index=False)
+
+
+def write_measures_parquet(measures, output_path):
+    # Long format, with repeated text values stored once per column
+    table = pa.Table.from_pandas(measures, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, str(output_path), compression="zstd")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default="output/data/opioid_rx")
+    parser.add_argument("--episodes", default="output/data/opioid_episodes.arrow",
+                        help="people, with opioid episodes (from opioid_episodes.py)")
+    parser.add_argument("--output", default="output/measures/measures_opioid.csv")
+    parser.add_argument("--group-by", nargs="+", default=DEFAULT_GROUP_BY)
+    parser.add_argument("--sparse", action="store_true", help="omit cells with denominator 0")
+    parser.add_argument("--num-weeks-bands", nargs="+", type=int,
+                        help="upper limit (weeks) of each num_weeks band, e.g. 18 52")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+
+    args = parser.parse_args()
+
+    people = read_arrow(args.episodes)
+    prescriptions = read_arrow(Path(args.input_dir) / "prescriptions.arrow")
+    codelist_names = [column for column in prescriptions.columns if column not in ("patient_id", "rx_day")]
+
+    if args.num_weeks_bands:
+        people["num_weeks"] = band_num_weeks(people["num_weeks"], sorted(args.num_weeks_bands))
+
+    measures = aligned_measures(people, prescriptions, codelist_names, args.group_by, sparse=args.sparse)
+    if args.format == "parquet":
+        write_measures_parquet(measures, args.output)
+    else:
+        write_measures_csv(measures, args.output)
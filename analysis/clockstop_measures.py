@@ -0,0 +1,97 @@
+###########################################################
+# This script counts closed RTT pathways (distinct referrals)
+#   per month, overall, by admission type, and by treatment
+#   specialty and admission type, from the clock stops
+#   extracted by dataset_definition_clockstops.py
+#
+# All breakdowns come from the one extract - the same counts as
+#   one ehrQL measure per specialty and admission type (see
+#   measures_checks.py), without re-scanning wl_clockstops
+#   for each. A referral is counted once per person, month and
+#   group, and only for people in that month's denominator
+#   (aged 0-109 at the start of the month).
+#
+# Output has the same format as ehrQL measures, with numerators
+#   and denominators rounded as in custom_functions.R (and the
+#   ratio calculated from the rounded counts)
+###########################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from clockstop_months import MONTHS, month_end
+from helpers import read_arrow, rounding
+
+# Measure name: group by columns
+MEASURES = {
+    "closed_total": [],
+    "closed_by_admission": ["admission"],
+    "closed_by_specialty": ["specialty", "admission"],
+}
+
+
+def clockstop_measures(people, clockstops):
+    # Denominator: people in it for each month (missing age = not in it)
+    in_denominator = (
+        people[[f"in_denominator_{i}" for i in range(len(MONTHS))]]
+        .fillna(False).astype(bool)
+        .set_index(people["patient_id"])
+    )
+    denominator = in_denominator.sum().to_numpy()
+
+    # Each clock stop's month and group, for people in that month's denominator
+    end_month = pd.to_datetime(clockstops["rtt_end_month"])
+    events = pd.DataFrame({
+        "patient_id": clockstops["patient_id"],
+        "referral_id": clockstops["referral_id"],
+        "interval": (end_month.dt.year - MONTHS[0].year) * 12 + end_month.dt.month - MONTHS[0].month,
+        "specialty": clockstops["specialty"].astype(object).fillna("Other"),
+        "admission": clockstops["admission"].astype(object).fillna("Unknown"),
+    }).dropna(subset=["referral_id"])
+    events = events[events["interval"].between(0, len(MONTHS) - 1)]
+    events = events[in_denominator.to_numpy()[
+        in_denominator.index.get_indexer(events["patient_id"]), events["interval"].to_numpy()
+    ]]
+
+    results = []
+    for measure, group_by in MEASURES.items():
+        keys = ["interval", *group_by]
+        numerator = events.drop_duplicates(["patient_id", "referral_id", *keys]).groupby(keys).size()
+
+        # Every month for every group seen, with 0 if no clock stops
+        groups = numerator.reset_index()[group_by].drop_duplicates() if group_by else pd.DataFrame(index=[0])
+        result = groups.merge(pd.DataFrame({"interval": range(len(MONTHS))}), how="cross")
+        result["numerator"] = numerator.reindex(pd.MultiIndex.from_frame(result[keys]) if group_by
+                                                else result["interval"], fill_value=0).to_numpy()
+        result["measure"] = measure
+        results.append(result)
+
+    measures = pd.concat(results, ignore_index=True)
+    interval = measures.pop("interval").to_numpy()
+    measures["interval_start"] = np.array(MONTHS)[interval]
+    measures["interval_end"] = np.array([month_end(start) for start in MONTHS])[interval]
+    measures["numerator"] = rounding(measures["numerator"])
+    measures["denominator"] = rounding(denominator[interval])
+    measures["ratio"] = measures["numerator"] / np.where(measures["denominator"] > 0, measures["denominator"], np.nan)
+
+    return measures[["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator",
+                     "specialty", "admission"]]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default="output/data/clockstops")
+    parser.add_argument("--output", default="output/measures/measures_checks.csv")
+
+    args = parser.parse_args()
+
+    people = read_arrow(Path(args.input_dir) / "dataset.arrow")
+    clockstops = read_arrow(Path(args.input_dir) / "clockstops.arrow")
+
+    measures = clockstop_measures(people, clockstops)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    measures.to_csv(args.output, index=False, na_rep="NA")
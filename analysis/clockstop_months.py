@@ -0,0 +1,17 @@
+##################################################################
+# Months of the closed pathway counts, shared by
+# dataset_definition_clockstops.py (the extract and each month's
+# denominator column) and clockstop_measures.py (the intervals)
+##################################################################
+
+
+import datetime
+
+
+# 13 months from May 2021 (the same intervals as measures_checks.py)
+MONTHS = [datetime.date(2021 + (4 + i) // 12, (4 + i) % 12 + 1, 1) for i in range(13)]
+
+
+def month_end(start):
+    next_month = datetime.date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return next_month - datetime.timedelta(days=1)
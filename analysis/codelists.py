@@ -3,161 +3,278 @@
 # of clinical conditions or prescribed medications. 
 # This script fetches the codelists identified in codelists.txt 
 # from OpenCodelists
+#
+# Parsed codelists are kept in a compiled cache (.cache/codelists.pickle),
+# keyed by the content hash of each CSV (and, for derived codelists,
+# the code that builds them), so CSVs are only re-parsed when they change.
+# New entries are saved once, when the script exits
+#
+# Codelists are loaded on first access (e.g. codelists.opioid_codes),
+# so scripts only load the codelists they use
 ####################################################################
 
 
-from ehrql import codelist_from_csv
+import atexit
+import hashlib
+import inspect
+import pickle
+import tempfile
+from pathlib import Path
+
 
- 
-### Opioid codelists
+### Compiled codelist cache
 
-opioid_codes = codelist_from_csv(
-    "codelists/user-anschaf-opioids-for-analgesia-dmd.csv",
-    column = "code"
-)
+CACHE_PATH = Path(".cache") / "codelists.pickle"
 
-long_opioid_codes = codelist_from_csv(
-    "codelists/user-anschaf-long-acting-opioids-dmd.csv",
-    column = "code"
-)
+# Bump to discard every cached codelist (e.g. if codelists are parsed differently)
+CACHE_VERSION = 1
 
-strong_opioid_codes1 = codelist_from_csv(
-    "codelists/opensafely-strongopioidsCW-dmd.csv",
-    column = "code"
-)
 
-strong_opioid_codes2 = codelist_from_csv(
-    "codelists/user-anschaf-strong-opioids-exc-tramadol-and-tapentadol-dmd.csv",
-    column = "code"
-)
+def _load_cache():
+    try:
+        with CACHE_PATH.open("rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # Missing, unreadable or incompatible cache - start again
+        return {}
+
+
+def _save_cache():
+    if not _changed:
+        return
+    tmp_path = None
+    try:
+        # Keep entries saved by other scripts since this one loaded the cache
+        cache = _load_cache()
+        cache.update({key: _cache[key] for key in _changed})
+
+        # Write a temporary file, then rename it, so the cache is never
+        #   left half-written
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=CACHE_PATH.parent, delete=False) as f:
+            tmp_path = Path(f.name)
+            pickle.dump(cache, f)
+        tmp_path.replace(CACHE_PATH)
+    except OSError:
+        # Read-only workspace - carry on without the cache
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+
+
+def _file_hash(filename):
+    return hashlib.sha256(Path(filename).read_bytes()).hexdigest()
+
+
+def _compiled(key, content_hash, build):
+    content_hash = f"{CACHE_VERSION}:{content_hash}"
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == content_hash:
+        return cached[1]
+    value = build()
+    _cache[key] = (content_hash, value)
+    _changed.add(key)
+    return value
+
+
+def compiled_codelist_from_csv(filename, column, category_column=None):
+    """Same as codelist_from_csv, but reuses the parsed codelist while
+    the CSV content is unchanged."""
+    # Imported here, so the codelist names and lists can be used without ehrQL
+    from ehrql import codelist_from_csv
+
+    return _compiled(
+        ("csv", filename, column, category_column),
+        _file_hash(filename),
+        lambda: codelist_from_csv(filename, column=column, category_column=category_column),
+    )
+
+
+def compiled_derived(name, filenames, build, build_hash=""):
+    """Reuses a codelist derived from other codelists while none of the
+    source CSVs, nor how it is built (build_hash), have changed."""
+    return _compiled(
+        ("derived", name),
+        build_hash + "".join(_file_hash(filename) for filename in filenames),
+        build,
+    )
+
+
+def _build_hash(name):
+    # The build function's code and its sources (in order), including how
+    #   any derived sources are built
+    sources, build = DERIVED_CODELISTS[name]
+    try:
+        code = inspect.getsource(build)
+    except (OSError, TypeError):
+        code = build.__code__.co_code.hex()
+    identity = [code, list(sources)] + [_build_hash(source) for source in sources if source in DERIVED_CODELISTS]
+    return hashlib.sha256(repr(identity).encode()).hexdigest()
+
+
+def _source_files(name):
+    if name in CSV_CODELISTS:
+        return [CSV_CODELISTS[name][0]]
+    sources, _ = DERIVED_CODELISTS[name]
+    return [filename for source in sources for filename in _source_files(source)]
+
+
+_cache = _load_cache()
+_changed = set()
+atexit.register(_save_cache)
+
+### Codelists from CSV: name -> (file, code column, category column)
+
+CSV_CODELISTS = {
+
+    ### Opioid codelists
+    "opioid_codes": ("codelists/user-anschaf-opioids-for-analgesia-dmd.csv", "code", None),
+    "long_opioid_codes": ("codelists/user-anschaf-long-acting-opioids-dmd.csv", "code", None),
+    "strong_opioid_codes1": ("codelists/opensafely-strongopioidsCW-dmd.csv", "code", None),
+    "strong_opioid_codes2": ("codelists/user-anschaf-strong-opioids-exc-tramadol-and-tapentadol-dmd.csv", "code", None),
+    "weak_opioid_codes": ("codelists/user-anschaf-weak-opioids-dmd.csv", "code", None),
+    "moderate_opioid_codes": ("codelists/user-anschaf-tramadol-and-tapentadol-dmd.csv", "code", None),
+
+    ### Other medications
+    "antidepressant_codes": ("codelists/user-anschaf-antidepressants-dmd.csv", "code", None),
+    "gabapentinoid_codes": ("codelists/user-anschaf-gabapentinoids-dmd.csv", "code", None),
+    "nsaid_codes": ("codelists/user-speed-vm-nsaids-dmd.csv", "code", None),
+    "tca_codes": ("codelists/user-speed-vm-antidepressants-for-pain-indication-dmd.csv", "code", None),
+
+    ### Ethnicity
+    "ethnicity_codes_16": ("codelists/opensafely-ethnicity-snomed-0removed.csv", "snomedcode", "Grouping_16"),
+    "ethnicity_codes_6": ("codelists/opensafely-ethnicity-snomed-0removed.csv", "snomedcode", "Grouping_6"),
+
+    ### Comorbidities
+    "oth_ca_codes": ("codelists/opensafely-cancer-excluding-lung-and-haematological-snomed.csv", "id", None),
+    "lung_ca_codes": ("codelists/opensafely-lung-cancer-snomed.csv", "id", None),
+    "haem_ca_codes": ("codelists/opensafely-haematological-cancer-snomed.csv", "id", None),
+    "osteoarthritis_codes": ("codelists/user-speed-vm-osteoarthritis-snomed-ct.csv", "code", None),
+    "depression_codes": ("codelists/opensafely-symptoms-depression.csv", "code", None),
+    "anxiety_codes": ("codelists/opensafely-symptoms-anxiety.csv", "code", None),
+    "smi_codes": ("codelists/primis-covid19-vacc-uptake-old-sev_mental_cod.csv", "code", None),
+    "cardiac_codes": ("codelists/primis-covid19-vacc-uptake-chd_cov.csv", "code", None),
+    "ckd_codes": ("codelists/primis-covid19-vacc-uptake-ckd15.csv", "code", None),
+    "liver_codes": ("codelists/primis-covid19-vacc-uptake-cld.csv", "code", None),
+    "diabetes_codes": ("codelists/primis-covid19-vacc-uptake-diab.csv", "code", None),
+    "copd_codes": ("codelists/primis-covid19-vacc-uptake-resp_cov.csv", "code", None),
+    "ra_codes": ("codelists/user-markdrussell-new-rheumatoid-arthritis.csv", "code", None),
+    "oud_codes": ("codelists/user-hjforbes-opioid-dependency-clinical-diagnosis.csv", "code", None),
+}
+
+
+### Codelists derived from other codelists: name -> (source codelists, function)
+
+DERIVED_CODELISTS = {
+    "short_opioid_codes": (
+        ["opioid_codes", "long_opioid_codes"],
+        lambda opioid_codes, long_opioid_codes: set(opioid_codes) - set(long_opioid_codes),
+    ),
+    "cancer_codes": (
+        ["oth_ca_codes", "lung_ca_codes", "haem_ca_codes"],
+        lambda oth_ca_codes, lung_ca_codes, haem_ca_codes: oth_ca_codes + lung_ca_codes + haem_ca_codes,
+    ),
+}
+
+
+### Code classes - each code maps to a bitmask of every class it is in
+
+# Medication class codelists, in bit order (bit 0 = opioid_codes)
+MEDICATION_CLASSES = [
+    "opioid_codes",
+    "gabapentinoid_codes",
+    "antidepressant_codes",
+    "tca_codes",
+    "nsaid_codes",
+    "weak_opioid_codes",
+    "strong_opioid_codes1",
+    "strong_opioid_codes2",
+    "long_opioid_codes",
+    "short_opioid_codes",
+    "moderate_opioid_codes",
+]
+
+# All opioid codelists (used for weekly prescribing measures)
+opioid_codelist_names = [
+    "opioid_codes",
+    "long_opioid_codes",
+    "short_opioid_codes",
+    "weak_opioid_codes",
+    "moderate_opioid_codes",
+    "strong_opioid_codes1",
+    "strong_opioid_codes2",
+]
+
+# Comorbidity class codelists (SNOMED CT), in bit order
+COMORBIDITY_CLASSES = [
+    "cancer_codes",
+    "diabetes_codes",
+    "cardiac_codes",
+    "copd_codes",
+    "liver_codes",
+    "ckd_codes",
+    "osteoarthritis_codes",
+    "ra_codes",
+    "depression_codes",
+    "anxiety_codes",
+    "smi_codes",
+    "oud_codes",
+]
+
+
+def _class_index(*class_codelists):
+    index = {}
+    for bit, class_codelist in enumerate(class_codelists):
+        for code in class_codelist:
+            index[code] = index.get(code, 0) | (1 << bit)
+    return index
+
+
+DERIVED_CODELISTS["medication_class_index"] = (MEDICATION_CLASSES, _class_index)
+DERIVED_CODELISTS["comorbidity_class_index"] = (COMORBIDITY_CLASSES, _class_index)
+
+
+def _class_masks(classes, index_name, codelist_name):
+    bit = 1 << classes.index(codelist_name)
+    return sorted({mask for mask in _get(index_name).values() if mask & bit})
+
+
+def medication_class_masks(codelist_name):
+    """Bitmasks in medication_class_index which include the given class."""
+    return _class_masks(MEDICATION_CLASSES, "medication_class_index", codelist_name)
+
+
+def comorbidity_class_masks(codelist_name):
+    """Bitmasks in comorbidity_class_index which include the given class."""
+    return _class_masks(COMORBIDITY_CLASSES, "comorbidity_class_index", codelist_name)
+
+
+def __getattr__(name):
+    # Only called for names not yet loaded - load, then keep as a module attribute
+    if name in CSV_CODELISTS:
+        filename, column, category_column = CSV_CODELISTS[name]
+        value = compiled_codelist_from_csv(filename, column, category_column)
+    elif name in DERIVED_CODELISTS:
+        sources, build = DERIVED_CODELISTS[name]
+        value = compiled_derived(
+            name,
+            _source_files(name),
+            lambda: build(*[_get(source) for source in sources]),
+            _build_hash(name),
+        )
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def _get(name):
+    # Module globals don't go through __getattr__, so look up lazily here
+    return globals()[name] if name in globals() else __getattr__(name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(CSV_CODELISTS) | set(DERIVED_CODELISTS))
 
-weak_opioid_codes = codelist_from_csv(
-    "codelists/user-anschaf-weak-opioids-dmd.csv",
-    column = "code"
-)
-
-moderate_opioid_codes = codelist_from_csv(
-    "codelists/user-anschaf-tramadol-and-tapentadol-dmd.csv",
-    column = "code"
-)
-
-
-short_opioid_codes = set(opioid_codes) - set(long_opioid_codes)
-
-
-### Other medications
-
-antidepressant_codes = codelist_from_csv(
-    "codelists/user-anschaf-antidepressants-dmd.csv",
-    column = "code"
-)
-
-gabapentinoid_codes = codelist_from_csv(
-    "codelists/user-anschaf-gabapentinoids-dmd.csv",
-    column = "code"
-)
-
-nsaid_codes = codelist_from_csv(
-    "codelists/user-speed-vm-nsaids-dmd.csv",
-    column = "code"
-)
-
-tca_codes = codelist_from_csv(
-    "codelists/user-speed-vm-antidepressants-for-pain-indication-dmd.csv",
-    column = "code"
-)
-
-### Ethnicity
-
-ethnicity_codes_16 = codelist_from_csv(
-    "codelists/opensafely-ethnicity-snomed-0removed.csv",
-    column="snomedcode",
-    category_column="Grouping_16",
-)
-
-ethnicity_codes_6 = codelist_from_csv(
-    "codelists/opensafely-ethnicity-snomed-0removed.csv",
-    column="snomedcode",
-    category_column="Grouping_6",
-)
-
-### Comorbidities
-
-oth_ca_codes = codelist_from_csv(
-  "codelists/opensafely-cancer-excluding-lung-and-haematological-snomed.csv",
-  column = "id"
-)
-
-lung_ca_codes = codelist_from_csv(
-  "codelists/opensafely-lung-cancer-snomed.csv",
-  column = "id"
-)
-
-haem_ca_codes = codelist_from_csv(
-  "codelists/opensafely-haematological-cancer-snomed.csv",
-  column = "id"
-)
-
-cancer_codes = (
-  oth_ca_codes +
-  lung_ca_codes +
-  haem_ca_codes
-)
-
-osteoarthritis_codes = codelist_from_csv(
-    "codelists/user-speed-vm-osteoarthritis-snomed-ct.csv",
-    column = "code"
-)
-
-depression_codes = codelist_from_csv(
-    "codelists/opensafely-symptoms-depression.csv",
-    column = "code"
-)
-
-anxiety_codes = codelist_from_csv(
-    "codelists/opensafely-symptoms-anxiety.csv",
-    column = "code"
-)
-
-smi_codes = codelist_from_csv(
-    "codelists/primis-covid19-vacc-uptake-old-sev_mental_cod.csv",
-    column = "code"
-)
-
-cardiac_codes = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-chd_cov.csv",
-  column = "code"
-)
-
-ckd_codes = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-ckd15.csv",
-  column = "code"
-)
-
-liver_codes = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-cld.csv",
-  column = "code"
-)
-
-diabetes_codes = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-diab.csv",
-  column = "code"
-)
-
-copd_codes = codelist_from_csv(
-  "codelists/primis-covid19-vacc-uptake-resp_cov.csv",
-  column = "code"
-)
-
-ra_codes = codelist_from_csv(
-  "codelists/user-markdrussell-new-rheumatoid-arthritis.csv",
-  column = "code"
-)
-
-oud_codes = codelist_from_csv(
-  "codelists/user-hjforbes-opioid-dependency-clinical-diagnosis.csv",
-  column = "code"
-)
 
 ### HRG codes
 hip_codes = ["HN12A","HN12B","HN12C","HN12D","HN12E","HN12F","HN13A","HN13B","HN13C","HN13D","HN13E","HN13F","HN13G","HN13H",
@@ -186,4 +303,20 @@ trauma_codes = ["HT12A","HT12B","HT12C","HT12D","HT12E","HT13A","HT13B","HT13C",
                 "HT34A","HT34B","HT34C","HT34D","HT34E","HT35Z","HT42A","HT42B","HT43A","HT43B","HT43C","HT43D","HT43E",
                 "HT44A","HT44B","HT44C","HT44D","HT44E","HT45Z","HT52A","HT52B","HT52C","HT53A","HT53B","HT53C","HT53D","HT53E",
                 "HT54A","HT54B","HT54C","HT54D","HT55Z","HT62A","HT62B","HT63A","HT63B","HT63C","HT63D","HT63E","HT63F",
-                "HT64A","HT64B","HT64C","HT64D","HT65Z","HT81A","HT81B","HT81C","HT81D","HT86A","HT86B","HT86C"]
\ No newline at end of file
+                "HT64A","HT64B","HT64C","HT64D","HT65Z","HT81A","HT81B","HT81C","HT81D","HT86A","HT86B","HT86C"]
+
+
+# HRG code -> procedure category (the HRG lists above do not overlap)
+hrg_categories = {
+    "hip": hip_codes,
+    "knee": knee_codes,
+    "hand": hand_codes,
+    "foot": foot_codes,
+    "shoulder": shoulder_codes,
+    "elbow": elbow_codes,
+    "complex": complex_codes,
+    "pain": pain_codes,
+    "trauma": trauma_codes,
+}
+
+hrg_category = {code: category for category, codes in hrg_categories.items() for code in codes}
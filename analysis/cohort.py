@@ -0,0 +1,33 @@
+##################################################################
+# Shared cohort (index) table, created once per project run by
+# dataset_definition_cohort.py (action: generate_cohort_index).
+# Datasets and measures import `cohort_index` instead of
+# re-deriving the latest pathway and censoring dates
+##################################################################
+
+
+import datetime
+
+from ehrql.tables import PatientFrame, Series, table_from_file
+
+
+@table_from_file("output/data/cohort_index.arrow")
+class cohort_index(PatientFrame):
+    # Number of RTT pathways per person
+    count_rtt_rows = Series(int)
+    count_rtt_start_date = Series(int)
+    count_patient_id = Series(int)
+    count_organisation_id = Series(int)
+    count_referral_id = Series(int)
+
+    # Latest waiting list
+    rtt_start_date = Series(datetime.date)
+    rtt_end_date = Series(datetime.date)
+    treatment_function = Series(str)
+    waiting_list_type = Series(str)
+    priority_type = Series(str)
+
+    # Censoring dates
+    reg_end_date = Series(datetime.date)
+    dod = Series(datetime.date)
+    end_date = Series(datetime.date)
@@ -0,0 +1,291 @@
+###############################################################
+# This script creates final cohorts for analysis
+# for: 1. all people with a closed RTT pathway (May21-Apr22)
+# and 2. all people with a closed RTT pathway for trauma/orthopaedic surgery
+#
+# Datasets are read and written one record batch at a time, and
+#   every exclusion step is counted in the same pass, so memory
+#   doesn't grow with cohort size. Missing values follow R's rules
+#   (& and | with NA, and subset() keeping only TRUE), so a step
+#   only keeps people for whom every condition is TRUE.
+#
+# Outputs (Arrow, zstd compressed):
+#   output/data/cohort_full_clockstops.arrow
+#   output/data/cohort_ortho_clockstops.arrow
+#   output/data/cohort_ortho_routine_clockstops.arrow
+#   output/clockstops/exclude_ortho.csv (rounded counts per step)
+###############################################################
+
+import csv
+import datetime
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from helpers import rounding
+
+
+# Exclusion steps: (step, label)
+STEPS = [
+    ("Step 1", "Full cohort"),
+    ("Step 2", "End date before start date"),
+    ("Step 3", "Not orthopaedic"),
+    ("Step 4", "Wait <130 weeks"),
+    ("Step 5", "Sex not male/female or missing"),
+    ("Step 6", "Age not 18-110 years"),
+    ("Step 7", "Missing priority/admission type"),
+    ("Step 8", "Not routine/admitted"),
+    ("Step 9", "History of cancer"),
+]
+
+WRITE_OPTIONS = pa.ipc.IpcWriteOptions(compression="zstd")
+
+
+def record_batches(path):
+    """Batches of an Arrow file (at least one, so empty files still give a schema)."""
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        if reader.num_record_batches == 0:
+            yield pa.RecordBatch.from_pylist([], schema=reader.schema)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            # Categorical columns as plain strings (as.character in R)
+            yield pa.RecordBatch.from_arrays(
+                [column.dictionary_decode() if pa.types.is_dictionary(column.type) else column
+                 for column in batch.columns],
+                names=batch.schema.names,
+            )
+
+
+### Helpers with R's missing value rules
+
+def days(dates):
+    # Dates as days since 1970-01-01, for date arithmetic
+    return pc.cast(dates, pa.int32())
+
+
+def date_days(year, month, day):
+    return (datetime.date(year, month, day) - datetime.date(1970, 1, 1)).days
+
+
+def all_of(*conditions):
+    # R's & (FALSE & NA is FALSE, TRUE & NA is NA)
+    result = conditions[0]
+    for condition in conditions[1:]:
+        result = pc.and_kleene(result, condition)
+    return result
+
+
+def any_of(*conditions):
+    # R's |
+    result = conditions[0]
+    for condition in conditions[1:]:
+        result = pc.or_kleene(result, condition)
+    return result
+
+
+def is_false(condition):
+    # x == FALSE (NA stays NA)
+    return pc.invert(condition)
+
+
+def count_true(condition):
+    # subset() keeps rows where the condition is TRUE (not NA)
+    return pc.sum(pc.fill_null(condition, False)).as_py() or 0
+
+
+def with_columns(batch, columns):
+    """Batch with new (or replaced) columns."""
+    arrays = dict(zip(batch.schema.names, batch.columns))
+    arrays.update(columns)
+    return pa.RecordBatch.from_pydict(arrays)
+
+
+### Derived variables
+
+def derive_full(batch):
+    start, end = days(batch.column("rtt_start_date")), days(batch.column("rtt_end_date"))
+    return with_columns(batch, {
+        "end_before_start": any_of(pc.greater(start, end), pc.is_null(start)),
+    })
+
+
+def derive_ortho(batch):
+    column = batch.column
+    num_weeks = column("num_weeks")
+    rtt_start, rtt_end, end = days(column("rtt_start_date")), days(column("rtt_end_date")), days(column("end_date"))
+    dod = days(column("dod"))
+    priority_type = column("priority_type")
+    waiting_list_type = column("waiting_list_type")
+    sex = column("sex")
+
+    routine = pc.if_else(
+        pc.is_in(priority_type, value_set=pa.array(["urgent", "two week wait"])), "Urgent",
+        pc.if_else(pc.is_in(priority_type, value_set=pa.array(["routine"])), "Routine", "Missing"),
+    )
+    admitted = pc.is_in(waiting_list_type, value_set=pa.array(["IRTT"]))
+    priority_type = pc.coalesce(priority_type, "Missing")
+
+    return with_columns(batch, {
+        # Month of WL start/end
+        "rtt_start_month": pc.floor_temporal(column("rtt_start_date"), unit="month"),
+        "rtt_end_month": pc.floor_temporal(column("rtt_end_date"), unit="month"),
+
+        # Were on multiple WL during study period
+        "rtt_multiple": pc.greater(column("count_rtt_start_date"), 1),
+
+        "routine": routine,
+        "priority_type": priority_type,
+        "admitted": admitted,
+
+        "missing_priority": pc.equal(priority_type, "Missing"),
+        "missing_admission": pc.invert(pc.is_in(waiting_list_type, value_set=pa.array(["IRTT", "ORTT"]))),
+
+        # Died while on WL
+        "died_during_wl": pc.fill_null(pc.less(dod, rtt_end), False),
+        "died_during_post": pc.fill_null(pc.less_equal(dod, pc.add(rtt_end, 182)), False),
+
+        # Long-term use
+        "no_opioid": pc.equal(column("opioid_pre_count2"), 0),
+        "any_opioid": pc.greater(column("opioid_pre_count2"), 0),
+        "prior_opioid_rx": pc.greater_equal(column("opioid_pre_count1"), 3),
+        "long_term_opioid": pc.greater_equal(column("opioid_pre_count2"), 3),
+
+        # Time on WL, censored at death/deregistration
+        "wait_time_adj": pc.add(pc.subtract(pc.min_element_wise(rtt_end, end, skip_nulls=False), rtt_start), 1),
+
+        # Time post-WL, censored at death/deregistration (max 182 days)
+        #    If study end date before RTT end date, set to zero
+        "post_time_adj": pc.if_else(
+            pc.greater_equal(end, rtt_end),
+            pc.add(pc.subtract(pc.min_element_wise(pc.add(rtt_end, 182), end, skip_nulls=False), rtt_end), 1),
+            0,
+        ),
+
+        # Time pre-WL (182 days for everyone)
+        "pre_time": pa.repeat(pa.scalar(182, pa.int32()), batch.num_rows),
+
+        # Any HRG
+        "any_nontrauma_hrg": any_of(*[column(f"{hrg}_hrg") for hrg in
+                                      ["knee", "hip", "shoulder", "elbow", "foot", "hand", "complex"]]),
+
+        # Week variable capped at one year (for some analyses)
+        "week52": pc.min_element_wise(num_weeks, 52, skip_nulls=False),
+
+        # Waiting time category
+        "wait_gp": pc.if_else(pc.less_equal(num_weeks, 18), "<=18 weeks",
+                              pc.if_else(pc.less_equal(num_weeks, 52), "19-52 weeks", "52+ weeks")),
+
+        "covid_timing": pc.if_else(pc.less(rtt_start, date_days(2020, 3, 1)), "Pre-COVID",
+                                   pc.if_else(pc.less(rtt_start, date_days(2021, 4, 1)), "Restriction period",
+                                              "Recovery period")),
+
+        "age_not_18_110": any_of(pc.less(column("age"), 18), pc.greater_equal(column("age"), 110)),
+        "sex_missing": pc.equal(sex, "unknown"),
+        "sex_not_m_f": all_of(pc.is_valid(sex),
+                              pc.invert(pc.is_in(sex, value_set=pa.array(["unknown", "male", "female"])))),
+
+        "not_routine_admitted": pc.invert(all_of(pc.equal(routine, "Routine"), admitted)),
+    })
+
+
+def ortho_steps(batch):
+    """Conditions for exclusion steps 4-9, and the two final cohorts."""
+    column = batch.column
+    wait_130 = pc.less_equal(column("num_weeks"), 130)
+    sex_ok = all_of(wait_130, is_false(column("sex_missing")), is_false(column("sex_not_m_f")))
+    age_ok = all_of(sex_ok, is_false(column("age_not_18_110")))
+    routine_admitted = all_of(age_ok, pc.equal(column("routine"), "Routine"), pc.equal(column("admitted"), True))
+
+    ortho_final = all_of(
+        is_false(column("cancer")), is_false(column("died_during_wl")), is_false(column("age_not_18_110")),
+        is_false(column("sex_missing")), is_false(column("sex_not_m_f")), wait_130,
+    )
+
+    steps = {
+        "Step 4": wait_130,
+        "Step 5": sex_ok,
+        "Step 6": age_ok,
+        "Step 7": all_of(age_ok, is_false(column("missing_priority")), is_false(column("missing_admission"))),
+        "Step 8": routine_admitted,
+        "Step 9": all_of(routine_admitted, is_false(column("cancer"))),
+    }
+    cohorts = {
+        "cohort_ortho_clockstops": ortho_final,
+        "cohort_ortho_routine_clockstops": all_of(
+            ortho_final, pc.equal(column("routine"), "Routine"), pc.equal(column("admitted"), True)
+        ),
+    }
+    return steps, cohorts
+
+
+class CohortWriter:
+    """Writes filtered batches to an Arrow file, opened with the first batch's schema."""
+
+    def __init__(self, path):
+        self.path = path
+        self.sink = None
+        self.writer = None
+
+    def write(self, batch, condition):
+        if self.writer is None:
+            self.sink = pa.OSFile(str(self.path), "wb")
+            self.writer = pa.ipc.new_file(self.sink, batch.schema, options=WRITE_OPTIONS)
+        self.writer.write_batch(batch.filter(condition, null_selection_behavior="drop"))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+def cohort_exclusions(full_path, ortho_path, data_dir, exclusions_path):
+    counts = {step: 0 for step, _ in STEPS}
+
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+
+    full_writer = CohortWriter(Path(data_dir) / "cohort_full_clockstops.arrow")
+    for batch in record_batches(full_path):
+        batch = derive_full(batch)
+        keep = is_false(batch.column("end_before_start"))
+        counts["Step 1"] += batch.num_rows
+        counts["Step 2"] += count_true(keep)
+        full_writer.write(batch, keep)
+    full_writer.close()
+
+    ortho_writers = {
+        name: CohortWriter(Path(data_dir) / f"{name}.arrow")
+        for name in ["cohort_ortho_clockstops", "cohort_ortho_routine_clockstops"]
+    }
+    for batch in record_batches(ortho_path):
+        batch = derive_ortho(batch)
+        steps, cohorts = ortho_steps(batch)
+        counts["Step 3"] += batch.num_rows
+        for step, condition in steps.items():
+            counts[step] += count_true(condition)
+        for name, condition in cohorts.items():
+            ortho_writers[name].write(batch, condition)
+    for writer in ortho_writers.values():
+        writer.close()
+
+    Path(exclusions_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(exclusions_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["step", "exclusion", "count"])
+        rounded = rounding([counts[step] for step, _ in STEPS])
+        for (step, exclusion), count in zip(STEPS, rounded):
+            writer.writerow([step, exclusion, "NA" if np.isnan(count) else int(count)])
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--full", default="output/data/dataset_full.arrow")
+    parser.add_argument("--ortho", default="output/data/dataset_ortho.arrow")
+    parser.add_argument("--data-dir", default="output/data")
+    parser.add_argument("--exclusions", default="output/clockstops/exclude_ortho.csv")
+
+    args = parser.parse_args()
+
+    cohort_exclusions(args.full, args.ortho, args.data_dir, args.exclusions)
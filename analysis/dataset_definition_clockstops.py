@@ -0,0 +1,75 @@
+###########################################################
+# This script extracts closed RTT pathways (clock stops)
+#   from May 2021 - May 2022 in one scan of wl_clockstops,
+#   for the monthly pathway counts by treatment specialty and
+#   admission type (clockstop_measures.py)
+#
+# Only what the counts need is extracted:
+#   dataset.arrow - one row per person: whether they are in
+#     each month's denominator (age 0-109 at the start of the
+#     month)
+#   clockstops.arrow - one row per clock stop with a referral ID:
+#     month of RTT end, referral ID, specialty group and
+#     admission type
+###########################################################
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import (
+    patients,
+    wl_clockstops)
+
+from clockstop_months import MONTHS, month_end
+
+# Most common treatment functions reported in public statistics
+TREATMENT_FUNCTIONS = ["100","120","130","140","150","160","170","300","301","320","330","340","400","410","430","502"]
+
+ORTHO_TREATMENT_FUNCTIONS = ["110","111","108","115"]
+
+# Treatment function -> specialty group (anything else is "Other")
+specialty_group = {
+    **{code: code for code in TREATMENT_FUNCTIONS},
+    **{code: "Trauma and orthopaedics" for code in ORTHO_TREATMENT_FUNCTIONS},
+}
+
+# Waiting list type -> admission type (anything else is "Unknown")
+admission_type = {
+    **{code: "Admitted" for code in ["IRTT","PTLI","RTTI"]},
+    **{code: "Not admitted" for code in ["ORTT","PTLO","RTTO"]},
+}
+
+
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=5000)
+
+
+#### Clock stops during the measures period ####
+
+clockstops = wl_clockstops.where(
+        wl_clockstops.referral_to_treatment_period_end_date.is_on_or_between(MONTHS[0], month_end(MONTHS[-1]))
+        & wl_clockstops.pseudo_referral_identifier.is_not_null()
+    )
+
+dataset.add_event_table(
+    "clockstops",
+    rtt_end_month=clockstops.referral_to_treatment_period_end_date.to_first_of_month(),
+    referral_id=clockstops.pseudo_referral_identifier,
+    specialty=clockstops.activity_treatment_function_code.map_values(specialty_group, default="Other"),
+    admission=clockstops.waiting_list_type.map_values(admission_type, default="Unknown"),
+)
+
+
+#### Denominator (age at the start of each month) ####
+
+for i, month in enumerate(MONTHS):
+    age = patients.age_on(month)
+    dataset.add_column(f"in_denominator_{i}", (age >= 0) & (age < 110))
+
+
+#### DEFINE POPULATION ####
+
+# Same people as the denominator in measures_checks.py
+#   (the age restriction is applied per month)
+dataset.define_population(
+        patients.sex.is_in(["male","female"])
+        & wl_clockstops.exists_for_patient()
+    )
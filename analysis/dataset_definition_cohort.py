@@ -0,0 +1,94 @@
+################################################################################
+# This script defines the shared cohort (index) table for people with a completed
+# RTT pathway from May 2021 - Apr 2022 for orthopaedic surgery:
+# one row per person with their latest pathway, index dates and censoring date.
+# All downstream orthopaedic datasets and measures read this table
+# (see cohort.py), so every action uses the same index dates
+################################################################################
+
+
+from ehrql import create_dataset, days, minimum_of
+from ehrql.tables.tpp import (
+    patients, 
+    practice_registrations,
+    wl_clockstops)
+
+dataset = create_dataset()
+
+
+#### Waiting list variables ####
+
+# WL data - exclude rows with missing dates/dates outside study period/end date before start date
+clockstops = wl_clockstops.where(
+        wl_clockstops.referral_to_treatment_period_end_date.is_on_or_between("2021-05-01", "2022-04-30")
+        & wl_clockstops.referral_to_treatment_period_start_date.is_on_or_before(wl_clockstops.referral_to_treatment_period_end_date)
+        & wl_clockstops.week_ending_date.is_on_or_between("2021-05-01", "2022-04-30")
+        & wl_clockstops.activity_treatment_function_code.is_in(["110"])
+    )
+
+# Number of RTT pathways per person
+dataset.count_rtt_rows = clockstops.count_for_patient()
+dataset.count_rtt_start_date = clockstops.referral_to_treatment_period_start_date.count_distinct_for_patient()
+dataset.count_patient_id = clockstops.pseudo_patient_pathway_identifier.count_distinct_for_patient()
+dataset.count_organisation_id = clockstops.pseudo_organisation_code_patient_pathway_identifier_issuer.count_distinct_for_patient()
+dataset.count_referral_id = clockstops.pseudo_referral_identifier.count_distinct_for_patient()
+
+# Latest waiting list
+#   Sort by IDs and start date to identify unique RTT pathways
+last_clockstops = clockstops.sort_by(
+        clockstops.referral_to_treatment_period_end_date,
+        clockstops.referral_to_treatment_period_start_date,
+        clockstops.pseudo_referral_identifier,
+        clockstops.pseudo_patient_pathway_identifier,
+        clockstops.pseudo_organisation_code_patient_pathway_identifier_issuer
+    ).last_for_patient()
+
+# RTT waiting list start date and end date
+dataset.rtt_start_date = last_clockstops.referral_to_treatment_period_start_date
+dataset.rtt_end_date = last_clockstops.referral_to_treatment_period_end_date
+
+# Other relevant columns
+dataset.treatment_function = last_clockstops.activity_treatment_function_code
+dataset.waiting_list_type = last_clockstops.waiting_list_type
+dataset.priority_type = last_clockstops.priority_type_code
+
+
+#### Censoring dates ####
+
+# Registered 6 months before WL start
+registrations = practice_registrations.spanning(
+        dataset.rtt_start_date - days(182), dataset.rtt_end_date
+    ).sort_by(
+        practice_registrations.end_date
+    ).last_for_patient()
+
+dataset.reg_end_date = registrations.end_date
+dataset.dod = patients.date_of_death
+dataset.end_date = minimum_of(dataset.reg_end_date, dataset.dod, dataset.rtt_end_date + days(365))
+
+
+#### DUMMY DATA ####
+
+# Generate dummy patients who already meet the cohort exclusions applied in
+#   cohort_exclusions.py (age, sex, wait length, alive at WL end), so
+#   population_size is close to the number of people reaching the analysis
+age = patients.age_on(dataset.rtt_start_date)
+
+dataset.configure_dummy_data(
+    population_size=10000,
+    additional_population_constraint=(
+        (age >= 18) & (age < 110)
+        & patients.sex.is_in(["male", "female"])
+        & ((dataset.rtt_end_date - dataset.rtt_start_date).weeks <= 130)
+        & (patients.date_of_death.is_null() | (patients.date_of_death >= dataset.rtt_end_date))
+    )
+)
+
+
+#### DEFINE POPULATION ####
+
+dataset.define_population(
+    dataset.end_date.is_on_or_after(dataset.rtt_end_date)
+    & registrations.exists_for_patient()
+    & last_clockstops.exists_for_patient()
+)
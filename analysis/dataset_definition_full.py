@@ -16,7 +16,6 @@ from ehrql.tables.tpp import (
 import codelists
 
 dataset = create_dataset()
-dataset.configure_dummy_data(population_size=10000)
 
 #### Waiting list variables ####
 
@@ -68,6 +67,20 @@ dataset.age = patients.age_on(dataset.rtt_start_date)
 dataset.sex = patients.sex
 
 
+#### DUMMY DATA ####
+
+# Generate dummy patients with a valid pathway (start date on or before
+#   end date), as people without one are excluded in cohort_exclusions.py
+dataset.configure_dummy_data(
+    population_size=10000,
+    additional_population_constraint=(
+        dataset.rtt_start_date.is_on_or_before(dataset.rtt_end_date)
+        & (dataset.age >= 18) & (dataset.age < 110)
+        & dataset.sex.is_in(["male", "female"])
+    )
+)
+
+
 #### DEFINE POPULATION ####
 
 dataset.define_population(
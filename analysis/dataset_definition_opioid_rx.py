@@ -0,0 +1,179 @@
+###########################################################
+# This script extracts opioid prescriptions for people with a
+#   completed RTT pathway for orthopaedic surgery (routine,
+#   admitted), as days relative to each person's RTT start date,
+#   for the weekly opioid prescribing rates (aligned_measures.py)
+#   and window sensitivity analyses (window_sweep.py)
+#
+# Outputs a directory with four tables:
+#   dataset.arrow - one row per person: waiting list and censoring
+#     offsets (days from RTT start) and grouping variables
+#   prescriptions.arrow - one row per opioid Rx: day relative to
+#     RTT start, and a flag for each codelist passed via --codelist
+#     (default: all opioid codelists)
+#   admissions.arrow - one row per admission within
+#     MAX_ADMISSION_DAYS of RTT end: day relative to RTT end, and
+#     HRG category
+#   oa_diagnoses.arrow - one row per osteoarthritis diagnosis in
+#     the MAX_LOOKBACK_YEARS before RTT start: day relative to
+#     RTT start
+###########################################################
+
+from ehrql import create_dataset, days, years
+from ehrql.tables.tpp import (
+    patients,
+    medications,
+    clinical_events,
+    apcs)
+
+import codelists
+from cohort import cohort_index
+
+# Widest windows extracted for window_sweep.py
+MAX_ADMISSION_DAYS = 60
+MAX_LOOKBACK_YEARS = 10
+
+##########
+
+from argparse import ArgumentParser
+
+parser = ArgumentParser()
+parser.add_argument("--codelist", nargs="+", default=codelists.opioid_codelist_names)
+
+args = parser.parse_args()
+
+##########
+
+
+# RTT waiting list start date and end date, and censoring date
+#   (death/deregistration/1 year after WL end)
+rtt_start_date = cohort_index.rtt_start_date
+rtt_end_date = cohort_index.rtt_end_date
+end_date = cohort_index.end_date
+
+
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=1000)
+
+
+#### Waiting list and censoring, as days from RTT start date ####
+
+dataset.wait_days = (rtt_end_date - rtt_start_date).days
+dataset.end_days = (end_date - rtt_start_date).days
+dataset.num_weeks = (rtt_end_date - rtt_start_date).weeks
+
+
+#### Opioid prescriptions ####
+
+# All opioid prescriptions during study period
+all_opioid_rx = medications.where(
+                medications.dmd_code.is_in(codelists.opioid_codes)
+                & medications.date.is_on_or_between(rtt_start_date - days(365), rtt_end_date + days(365))
+            )
+
+# Drug classes of each Rx (bitmask - see codelists.MEDICATION_CLASSES)
+all_opioid_rx.med_class = all_opioid_rx.dmd_code.to_category(codelists.medication_class_index)
+
+# One flag per codelist
+in_codelist = {}
+for codelist_name in args.codelist:
+    if codelist_name in codelists.MEDICATION_CLASSES:
+        in_codelist[codelist_name] = all_opioid_rx.med_class.is_in(codelists.medication_class_masks(codelist_name))
+    else:
+        in_codelist[codelist_name] = all_opioid_rx.dmd_code.is_in(getattr(codelists, codelist_name))
+
+dataset.add_event_table(
+    "prescriptions",
+    rx_day=(all_opioid_rx.date - rtt_start_date).days,
+    **in_codelist,
+)
+
+
+#### Grouping/stratification variables ####
+
+# (prior_opioid_rx is derived from the prescriptions table - see opioid_episodes.py)
+
+# Cancer and osteoarthritis diagnoses, from one scan of clinical events
+#   (flags use the past 5 years, diagnoses table the widest lookback)
+clin_events_lookback = clinical_events.where(
+        clinical_events.date.is_on_or_between(rtt_start_date - years(MAX_LOOKBACK_YEARS), rtt_start_date)
+        & clinical_events.snomedct_code.is_in(codelists.comorbidity_class_index)
+    )
+clin_events_lookback.comorb_class = clin_events_lookback.snomedct_code.to_category(codelists.comorbidity_class_index)
+clin_events_5yrs = clin_events_lookback.where(clin_events_lookback.date.is_on_or_after(rtt_start_date - years(5)))
+clin_events_5yrs.comorb_class = clin_events_5yrs.snomedct_code.to_category(codelists.comorbidity_class_index)
+
+cancer = clin_events_5yrs.where(
+        clin_events_5yrs.comorb_class.is_in(codelists.comorbidity_class_masks("cancer_codes"))
+    ).exists_for_patient()
+
+dataset.oa_diagnosis = clin_events_5yrs.where(
+            clin_events_5yrs.comorb_class.is_in(codelists.comorbidity_class_masks("osteoarthritis_codes"))
+    ).exists_for_patient()
+
+oa_events = clin_events_lookback.where(
+        clin_events_lookback.comorb_class.is_in(codelists.comorbidity_class_masks("osteoarthritis_codes"))
+    )
+dataset.add_event_table(
+    "oa_diagnoses",
+    diagnosis_day=(oa_events.date - rtt_start_date).days,
+)
+
+# Knee or hip procedure (flags within 15 days of RTT end, admissions
+#   table within the widest window)
+admissions = apcs.where(
+        apcs.admission_date.is_on_or_between(rtt_end_date - days(MAX_ADMISSION_DAYS),
+                                             rtt_end_date + days(MAX_ADMISSION_DAYS))
+    )
+admissions.hrg_category = admissions.spell_core_hrg_sus.map_values(codelists.hrg_category)
+
+dataset.add_event_table(
+    "admissions",
+    admission_day=(admissions.admission_date - rtt_end_date).days,
+    hrg_category=admissions.hrg_category,
+)
+
+admit_events = admissions.where(
+        admissions.admission_date.is_on_or_between(rtt_end_date - days(15), rtt_end_date + days(15))
+    )
+admit_events.hrg_category = admit_events.spell_core_hrg_sus.map_values(codelists.hrg_category)
+
+dataset.hip_hrg = admit_events.where(
+        admit_events.hrg_category == "hip"
+    ).exists_for_patient()
+
+dataset.knee_hrg = admit_events.where(
+        admit_events.hrg_category == "knee"
+    ).exists_for_patient()
+
+
+#### DEFINE POPULATION ####
+
+# Same people as the denominator in measures_opioid_all.py
+age = patients.age_on(rtt_start_date)
+sex = patients.sex
+
+dataset.define_population(
+        # Adults with non-missing age/sex
+        (age >= 18)
+        & (age < 110)
+        & (sex.is_in(["male","female"]))
+
+        # Registered for >6 months
+        & cohort_index.exists_for_patient()
+
+        # No cancer
+        & ~cancer
+
+        # Censoring date (death/deregistration) after start of waiting list
+        & (end_date.is_on_or_after(rtt_end_date))
+
+        # Routine priority type
+        & (cohort_index.priority_type.is_in(["routine"]))
+
+        # Admitted
+        & (cohort_index.waiting_list_type.is_in(["IRTT","PTLI","RTTI"]))
+
+        # Alive at end of waiting list
+        & ((patients.date_of_death >= rtt_end_date) | patients.date_of_death.is_null())
+    )
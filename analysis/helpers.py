@@ -0,0 +1,43 @@
+##################################################################
+# Helpers shared by the python analysis actions: reading and
+# writing Arrow files, and rounding counts for release
+##################################################################
+
+
+import numpy as np
+import pyarrow as pa
+
+
+def rounding(values):
+    # Same as rounding() in custom_functions.R: 0 stays 0, 1-7 are
+    #   redacted (NA), otherwise rounded to the nearest 5
+    values = np.asarray(values, dtype=float)
+    return np.where(values == 0, 0, np.where(values > 7, np.round(values / 5) * 5, np.nan))
+
+
+def read_table(path):
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def read_arrow(path):
+    return read_table(path).to_pandas()
+
+
+def write_arrow(table, path):
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def person_rows(patient_ids, event_patient_ids):
+    """Row of each event's person in the (sorted) patient_ids. Every
+    event must be for someone in patient_ids - if the people table is
+    from a different extract, fail rather than count events against
+    the wrong person."""
+    rows = np.searchsorted(patient_ids, event_patient_ids)
+    found = rows < len(patient_ids)
+    found[found] = patient_ids[rows[found]] == event_patient_ids[found]
+    if not found.all():
+        raise ValueError(f"{(~found).sum()} events are for people not in the people table")
+    return rows
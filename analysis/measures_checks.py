@@ -4,6 +4,9 @@
 # It counts the monthly number of records by RTT start date,
 # RTT end date and week ending date.
 # It also counts number of patients by RTT end date.
+# project.yaml uses clockstop_measures.py instead, which also
+#   breaks the counts down by treatment specialty and admission
+#   type from one extract - this is kept to cross-check it
 ###########################################################
 
 from ehrql import INTERVAL, Measures, months
@@ -49,33 +52,6 @@ count_not_admitted_ortho = wl_clockstops.where(
     ).pseudo_referral_identifier.count_distinct_for_patient()
 
 
-# By treatment specialty (only include most common groups reported in public statistics)
-
-# trt_func = ["100","120","130","140","150","160","170","300","301","320","330","340","400","410","430","502",]
-
-# count_var = {}
-
-# for code in trt_func:
-
-#     count_var["count_" + code] =  wl_clockstops.where(
-#         wl_clockstops.referral_to_treatment_period_end_date.is_during(INTERVAL)
-#         & wl_clockstops.activity_treatment_function_code.is_in([code])
-#     ).pseudo_referral_identifier.count_distinct_for_patient()
-    
-#     count_var["count_admitted_" + code] =  wl_clockstops.where(
-#         wl_clockstops.referral_to_treatment_period_end_date.is_during(INTERVAL)
-#         & wl_clockstops.waiting_list_type.is_in(["IRTT","PTLI","RTTI"])
-#         & wl_clockstops.activity_treatment_function_code.is_in([code])
-#     ).pseudo_referral_identifier.count_distinct_for_patient()
-    
-#     count_var["count_not_admitted_" + code] =  wl_clockstops.where(
-#         wl_clockstops.referral_to_treatment_period_end_date.is_during(INTERVAL)
-#         & wl_clockstops.waiting_list_type.is_in(["ORTT","PTLO","RTTO"])
-#         & wl_clockstops.activity_treatment_function_code.is_in([code])
-#     ).pseudo_referral_identifier.count_distinct_for_patient()
-
-    
-
 ######
 
 measures = Measures()
@@ -122,17 +98,3 @@ measures.define_measure(
     name="closed_not_admit_ortho",
     numerator=count_not_admitted_ortho
     )
-
-# for code in trt_func:
-#     measures.define_measure(
-#         name=f"count_{code}",
-#         numerator=count_var["count_" + code]
-#     )
-#     measures.define_measure(
-#         name=f"count_admit_{code}",
-#         numerator=count_var["count_admitted_" + code]
-#     )
-#     measures.define_measure(
-#         name=f"count_not_admit_{code}",
-#         numerator=count_var["count_not_admitted_" + code]
-#     )
@@ -145,6 +145,8 @@ sex = patients.sex
 
 measures = create_measures()
 
+measures.configure_dummy_data(population_size=1000)
+
 
 # Denominator 
 denominator = (        
@@ -3,52 +3,44 @@
 #   in the 6 months pre-waiting list, during waiting list and 
 #   12 months post-waiting list for people with a completed RTT pathway
 #   for orthopaedic surgery only
+# Measures are defined for each codelist passed via --codelist
+#   (default: all opioid codelists), so every codelist is
+#   counted in a single extraction
+# project.yaml uses aligned_measures.py instead, which gives the
+#   same measures in one pass - this is kept to cross-check it
 ###########################################################
 
 from ehrql import INTERVAL, create_measures, weeks, days, minimum_of, years, when, case
 from ehrql.tables.tpp import (
     patients, 
-    practice_registrations,
     medications,
     clinical_events,
     addresses,
-    wl_clockstops,
     apcs)
 
 import codelists
+from cohort import cohort_index
 
 ##########
 
 from argparse import ArgumentParser
 
 parser = ArgumentParser()
-parser.add_argument("--codelist")
+parser.add_argument("--codelist", nargs="+", default=codelists.opioid_codelist_names)
 
 args = parser.parse_args()
 
-codelist_name = args.codelist
-codelist = getattr(codelists, codelist_name)
+codelist_names = args.codelist
 
 ##########
 
 
-# WL data - exclude rows with missing dates/dates outside study period/end date before start date
-last_clockstops = wl_clockstops.where(
-        wl_clockstops.referral_to_treatment_period_end_date.is_on_or_between("2021-05-01", "2022-04-30")
-        & wl_clockstops.referral_to_treatment_period_start_date.is_on_or_before(wl_clockstops.referral_to_treatment_period_end_date)
-        & wl_clockstops.week_ending_date.is_on_or_between("2021-05-01", "2022-04-30")
-        & wl_clockstops.activity_treatment_function_code.is_in(["110"])
-    ).sort_by(
-        wl_clockstops.referral_to_treatment_period_start_date,
-        wl_clockstops.pseudo_referral_identifier,
-        wl_clockstops.pseudo_patient_pathway_identifier,
-        wl_clockstops.pseudo_organisation_code_patient_pathway_identifier_issuer
-    ).last_for_patient()
-
+# Latest waiting list and censoring date come from the shared cohort table
+#   (see dataset_definition_cohort.py)
 
 # RTT waiting list start date and end date
-rtt_start_date = last_clockstops.referral_to_treatment_period_start_date
-rtt_end_date = last_clockstops.referral_to_treatment_period_end_date
+rtt_start_date = cohort_index.rtt_start_date
+rtt_end_date = cohort_index.rtt_end_date
 num_weeks = (rtt_end_date - rtt_start_date).weeks
 
 wait_gp = case(
@@ -69,6 +61,9 @@ all_opioid_rx = medications.where(
                 & medications.date.is_on_or_between(rtt_start_date - days(365), rtt_end_date + days(365))
             )
 
+# Drug classes of each Rx (bitmask - see codelists.MEDICATION_CLASSES)
+all_opioid_rx.med_class = all_opioid_rx.dmd_code.to_category(codelists.medication_class_index)
+
 # Standardise Rx dates relative to RTT start date for prescribing during WL 
 all_opioid_rx.tmp_wait_date = tmp_date + days((all_opioid_rx.date - rtt_start_date).days)
 
@@ -81,34 +76,37 @@ all_opioid_rx.tmp_pre_date = tmp_date + days((all_opioid_rx.date - (rtt_start_da
 
 ### Prescribing variables for numerator ####
 
-# Num Rx during waiting list (up to 1 year)
-count_opioid_wait = all_opioid_rx.where(
-                all_opioid_rx.dmd_code.is_in(codelist)
+# Num Rx during waiting list (up to 1 year), post waiting list (up to 12 months)
+#   and pre waiting list (up to 6 months), for each codelist
+count_opioid_wait = {}
+count_opioid_post = {}
+count_opioid_pre = {}
+
+for codelist_name in codelist_names:
+
+    if codelist_name in codelists.MEDICATION_CLASSES:
+        in_codelist = all_opioid_rx.med_class.is_in(codelists.medication_class_masks(codelist_name))
+    else:
+        in_codelist = all_opioid_rx.dmd_code.is_in(getattr(codelists, codelist_name))
+
+    count_opioid_wait[codelist_name] = all_opioid_rx.where(
+                in_codelist
                 & all_opioid_rx.tmp_wait_date.is_during(INTERVAL)
             ).count_for_patient()
 
-# Num Rx post waiting list (up to 12 months)
-count_opioid_post = all_opioid_rx.where(
-                all_opioid_rx.dmd_code.is_in(codelist)
+    count_opioid_post[codelist_name] = all_opioid_rx.where(
+                in_codelist
                 & all_opioid_rx.tmp_post_date.is_during(INTERVAL)
             ).count_for_patient()
 
-# Num Rx pre waiting list (up to 6 months)
-count_opioid_pre = all_opioid_rx.where(
-                all_opioid_rx.dmd_code.is_in(codelist)
+    count_opioid_pre[codelist_name] = all_opioid_rx.where(
+                in_codelist
                 & all_opioid_rx.tmp_pre_date.is_during(INTERVAL)
             ).count_for_patient()
 
 
-## Censoring date
-registrations = practice_registrations.spanning(
-        rtt_start_date - days(182), rtt_end_date
-    ).sort_by(
-        practice_registrations.end_date
-    ).last_for_patient()
-
-reg_end_date = registrations.end_date
-end_date = minimum_of(reg_end_date, patients.date_of_death, rtt_end_date + days(365))
+## Censoring date (death/deregistration/1 year after WL end)
+end_date = cohort_index.end_date
 
 # Standardise end date relative to RTT start and end dates
 tmp_end_date_rtt_start = tmp_date + days((end_date - rtt_start_date).days)
@@ -118,11 +116,15 @@ tmp_end_date_rtt_end = tmp_date + days((end_date - rtt_end_date).days)
 tmp_rtt_end = tmp_date + days((rtt_end_date - rtt_start_date).days)
 
 
-## Cancer diagnosis in past 5 years 
-cancer = clinical_events.where(
-        clinical_events.snomedct_code.is_in(codelists.cancer_codes)
-    ).where(
+## Cancer and osteoarthritis diagnoses in past 5 years, from one scan of clinical events
+clin_events_5yrs = clinical_events.where(
         clinical_events.date.is_on_or_between(rtt_start_date - years(5), rtt_start_date)
+        & clinical_events.snomedct_code.is_in(codelists.comorbidity_class_index)
+    )
+clin_events_5yrs.comorb_class = clin_events_5yrs.snomedct_code.to_category(codelists.comorbidity_class_index)
+
+cancer = clin_events_5yrs.where(
+        clin_events_5yrs.comorb_class.is_in(codelists.comorbidity_class_masks("cancer_codes"))
     ).exists_for_patient()
 
 
@@ -141,23 +143,20 @@ sex = patients.sex
 
 ### Knee or hip procedure ###
 admit_events = apcs.where(apcs.admission_date.is_on_or_between(rtt_end_date - days(15), rtt_end_date + days(15)))
+admit_events.hrg_category = admit_events.spell_core_hrg_sus.map_values(codelists.hrg_category)
 
 hip_hrg = admit_events.where(
-        apcs.spell_core_hrg_sus.is_in(codelists.hip_codes)
+        admit_events.hrg_category == "hip"
     ).exists_for_patient()
 
 knee_hrg = admit_events.where(
-        apcs.spell_core_hrg_sus.is_in(codelists.knee_codes)
+        admit_events.hrg_category == "knee"
     ).exists_for_patient()
 
 
 ### Osteoarthritis diagnosis ###
-clin_events_5yrs = clinical_events.where(
-        clinical_events.date.is_on_or_between(rtt_start_date - years(5), rtt_start_date)
-    )
-
 oa_diagnosis = clin_events_5yrs.where(
-            clin_events_5yrs.snomedct_code.is_in(codelists.osteoarthritis_codes)
+            clin_events_5yrs.comorb_class.is_in(codelists.comorbidity_class_masks("osteoarthritis_codes"))
     ).exists_for_patient()
 
 
@@ -179,7 +178,7 @@ denominator = (
         & (sex.is_in(["male","female"]))
 
         # Registered for >6 months
-        & registrations.exists_for_patient()
+        & cohort_index.exists_for_patient()
 
         # No cancer
         & ~cancer
@@ -188,58 +187,55 @@ denominator = (
         & (end_date.is_on_or_after(rtt_end_date))
 
         # Routine priority type
-        & (last_clockstops.priority_type_code.is_in(["routine"]))       
+        & (cohort_index.priority_type.is_in(["routine"]))       
         
         # Admitted
-        & (last_clockstops.waiting_list_type.is_in(["IRTT","PTLI","RTTI"]))
+        & (cohort_index.waiting_list_type.is_in(["IRTT","PTLI","RTTI"]))
 
         # Alive at end of waiting list
         & ((patients.date_of_death >= rtt_end_date) | patients.date_of_death.is_null())
     )
 
 
-# Prescribing during WL
-measures.define_measure(
-    name="count_wait",
-    numerator=count_opioid_wait,
-    # Denominator = only include people whose RTT end date and study end date are after interval end date
-    #   IOW, exclude people who are no longer on waiting list or have been censored
-    denominator=denominator & (tmp_end_date_rtt_start > INTERVAL.end_date) & (tmp_rtt_end > INTERVAL.end_date),
-    intervals=weeks(52).starting_on("2000-01-01"),
-    group_by={"prior_opioid_rx": prior_opioid_rx,
-              "num_weeks": num_weeks,
-              "oa_diagnosis": oa_diagnosis,
-              "hip_hrg": hip_hrg,
-              "knee_hrg": knee_hrg}
-    )
-
-# Prescribing post WL
-measures.define_measure(
-    name="count_post",
-    numerator=count_opioid_post,
-    # Denominator = only include people whose RTT end date is after interval end date
-    #   IOW, exclude people who have been censored
-    denominator=denominator & (tmp_end_date_rtt_end > INTERVAL.end_date),
-    intervals=weeks(52).starting_on("2000-01-01"),
-    group_by={"prior_opioid_rx": prior_opioid_rx,
-              "num_weeks": num_weeks,
-              "oa_diagnosis": oa_diagnosis,
-              "hip_hrg": hip_hrg,
-              "knee_hrg": knee_hrg}
-    )
+for codelist_name in codelist_names:
+
+    # Codelist name as a group, so all codelists can share one output file
+    group_by = {"codelist": case(when(cohort_index.exists_for_patient()).then(codelist_name)),
+                "prior_opioid_rx": prior_opioid_rx,
+                "num_weeks": num_weeks,
+                "oa_diagnosis": oa_diagnosis,
+                "hip_hrg": hip_hrg,
+                "knee_hrg": knee_hrg}
+
+    # Prescribing during WL
+    measures.define_measure(
+        name=f"count_wait_{codelist_name}",
+        numerator=count_opioid_wait[codelist_name],
+        # Denominator = only include people whose RTT end date and study end date are after interval end date
+        #   IOW, exclude people who are no longer on waiting list or have been censored
+        denominator=denominator & (tmp_end_date_rtt_start > INTERVAL.end_date) & (tmp_rtt_end > INTERVAL.end_date),
+        intervals=weeks(52).starting_on("2000-01-01"),
+        group_by=group_by
+        )
 
-# Prescribing pre WL
-measures.define_measure(
-    name="count_pre",
-    numerator=count_opioid_pre,
-    # Denominator = only include people whose RTT end date is after interval end date
-    #   IOW, exclude people who have been censored
-    denominator=denominator,
-    intervals=weeks(26).starting_on("2000-01-01"),
-    group_by={"prior_opioid_rx": prior_opioid_rx,
-              "num_weeks": num_weeks,
-              "oa_diagnosis": oa_diagnosis,
-              "hip_hrg": hip_hrg,
-              "knee_hrg": knee_hrg}
-    )
+    # Prescribing post WL
+    measures.define_measure(
+        name=f"count_post_{codelist_name}",
+        numerator=count_opioid_post[codelist_name],
+        # Denominator = only include people whose RTT end date is after interval end date
+        #   IOW, exclude people who have been censored
+        denominator=denominator & (tmp_end_date_rtt_end > INTERVAL.end_date),
+        intervals=weeks(52).starting_on("2000-01-01"),
+        group_by=group_by
+        )
 
+    # Prescribing pre WL
+    measures.define_measure(
+        name=f"count_pre_{codelist_name}",
+        numerator=count_opioid_pre[codelist_name],
+        # Denominator = only include people whose RTT end date is after interval end date
+        #   IOW, exclude people who have been censored
+        denominator=denominator,
+        intervals=weeks(26).starting_on("2000-01-01"),
+        group_by=group_by
+        )
@@ -0,0 +1,126 @@
+###########################################################
+# This script assembles a dataset from separately extracted
+#   pieces into a single Arrow file, sorted by patient_id:
+#
+#   --shards: shards of the same columns (e.g. from
+#     dataset_definition_ortho.py --shard k --num-shards n),
+#     stacked into one table
+#   --group: a column group (e.g. from
+#     dataset_definition_ortho.py --groups medicines), given
+#     as one file or as its shards. Groups are joined on
+#     patient_id, in the order given
+#
+# --compact narrows integer columns to the smallest type that
+#   holds their values, dictionary-encodes string columns and
+#   compresses the file (zstd). --format parquet writes Parquet
+#   (with row group statistics) instead of an Arrow (Feather) file
+###########################################################
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from helpers import read_table
+
+
+# Rows per record batch in Arrow output, so readers can stream the file
+BATCH_ROWS = 64 * 1024
+
+# Narrower integer types, with the (exclusive) limit of their values
+INT_TYPES = [(pa.int8(), 2 ** 7), (pa.int16(), 2 ** 15), (pa.int32(), 2 ** 31)]
+
+
+def stack_shards(shards):
+    # Shards are written independently, so categorical columns can have
+    #   different dictionaries - unify them before writing one file
+    stacked = pa.concat_tables(shards).unify_dictionaries()
+    stacked = stacked.take(pc.sort_indices(stacked, sort_keys=[("patient_id", "ascending")]))
+
+    if len(pc.unique(stacked["patient_id"])) != stacked.num_rows:
+        raise ValueError("patients appear in more than one shard")
+
+    return stacked
+
+
+def join_groups(groups):
+    # Every group is extracted with the same population, so the first
+    #   group gives the patients; a patient missing from a later group
+    #   (e.g. with dummy data) gets missing values for its columns
+    joined = groups[0]
+    for group in groups[1:]:
+        rows = pc.index_in(joined["patient_id"], value_set=group["patient_id"])
+        for name in group.column_names:
+            if name == "patient_id":
+                continue
+            if name in joined.column_names:
+                raise ValueError(f"column {name} appears in more than one group")
+            joined = joined.append_column(group.schema.field(name), group[name].take(rows))
+
+    return joined
+
+
+def compact(table):
+    """Smallest integer types and dictionary-encoded strings. (Boolean
+    columns are already stored as bits.)"""
+    table = table.combine_chunks()
+    columns = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_integer(field.type) and field.name != "patient_id":
+            bounds = pc.min_max(column)
+            lowest, highest = bounds["min"].as_py(), bounds["max"].as_py()
+            for int_type, limit in INT_TYPES:
+                if lowest is None or (-limit <= lowest and highest < limit):
+                    column = column.cast(int_type)
+                    break
+        elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            column = column.dictionary_encode()
+        columns.append(column)
+    return pa.table(columns, names=table.column_names)
+
+
+def write_dataset(table, output_path, file_format="arrow", compression=None):
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    if file_format == "parquet":
+        pq.write_table(table, str(output_path), compression=compression or "none", write_statistics=True)
+        return
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.OSFile(str(output_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table, max_chunksize=BATCH_ROWS)
+
+
+def merge_dataset(groups, output_path, workers=4, compact_output=False, file_format="arrow"):
+    # Read every file in parallel (pyarrow releases the GIL while reading)
+    paths = [path for shard_paths in groups for path in shard_paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tables = dict(zip(paths, pool.map(read_table, paths)))
+
+    merged = join_groups([stack_shards([tables[path] for path in shard_paths]) for shard_paths in groups])
+
+    if compact_output:
+        write_dataset(compact(merged), output_path, file_format, compression="zstd")
+    else:
+        write_dataset(merged, output_path, file_format)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--shards", nargs="+")
+    parser.add_argument("--group", nargs="+", action="append", default=[],
+                        help="files for one column group (repeat for each group)")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--compact", action="store_true", help="narrow integers, encode strings, compress")
+    parser.add_argument("--format", choices=["arrow", "parquet"], default="arrow")
+
+    args = parser.parse_args()
+
+    groups = ([args.shards] if args.shards else []) + args.group
+    if not groups:
+        parser.error("give --shards or at least one --group")
+
+    merge_dataset(groups, args.output, workers=args.workers, compact_output=args.compact, file_format=args.format)
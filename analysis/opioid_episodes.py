@@ -0,0 +1,147 @@
+###########################################################
+# This script derives opioid exposure episodes and long-term
+#   use from each person's sorted opioid Rx days, extracted
+#   once by dataset_definition_opioid_rx.py (rather than
+#   counting Rx in separate windows)
+#
+# An episode is a run of Rx where each Rx is within --gap days
+#   of the previous one, and is assumed to continue for --gap
+#   days after its last Rx.
+#
+# Per person (days are relative to RTT start, missing if no Rx):
+#   first_rx_day, last_rx_day - first/last Rx in the extract
+#   first_rx_wait - first Rx on the waiting list
+#   first_rx_post, last_rx_post - first/last Rx after RTT end
+#     (days from RTT end)
+#   num_episodes - number of episodes
+#   prior_rx_count - Rx in the 182 days before RTT start
+#   prior_opioid_rx - prior_rx_count >= 3
+#   long_term_episode - an episode ongoing at RTT start, with at
+#     least --min-rx Rx before RTT start, lasting at least
+#     --long-term-days before RTT start (not the same as
+#     long_term_opioid in the cohorts, which is 3+ Rx in the 91
+#     days before RTT start - see cohort_exclusions.py)
+#   post_exposure_days - days after RTT end that the episode
+#     ongoing at RTT end continues (censored at end_days)
+#   persistent_post - post_exposure_days >= --persistent-days
+###########################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+from helpers import person_rows, read_arrow, write_arrow
+
+
+GAP_DAYS = 30
+MIN_RX = 3
+LONG_TERM_DAYS = 90
+PERSISTENT_DAYS = 90
+
+
+def first_per_person(rx_person, values, selected, num_people):
+    """Value of the first selected Rx per person (Rx sorted by person
+    and day), as a float array with NaN for people with none."""
+    result = np.full(num_people, np.nan)
+    people, first = np.unique(rx_person[selected], return_index=True)
+    result[people] = values[selected][first]
+    return result
+
+
+def last_per_person(rx_person, values, selected, num_people):
+    result = np.full(num_people, np.nan)
+    people, last = np.unique(rx_person[selected][::-1], return_index=True)
+    result[people] = values[selected][::-1][last]
+    return result
+
+
+def opioid_episodes(people, prescriptions, gap=GAP_DAYS, min_rx=MIN_RX,
+                    long_term_days=LONG_TERM_DAYS, persistent_days=PERSISTENT_DAYS):
+    """The people table (sorted by patient_id) with episode columns added."""
+    people = people.sort_values("patient_id").reset_index(drop=True)
+    num_people = len(people)
+    wait_days = people["wait_days"].to_numpy(dtype=np.int64)
+    end_days = people["end_days"].to_numpy(dtype=np.int64)
+
+    # One sorted array of Rx days, in runs per person
+    rx_person = person_rows(people["patient_id"].to_numpy(), prescriptions["patient_id"].to_numpy())
+    rx_day = prescriptions["rx_day"].to_numpy(dtype=np.int64)
+    order = np.lexsort((rx_day, rx_person))
+    rx_person, rx_day = rx_person[order], rx_day[order]
+    every_rx = np.ones(len(rx_day), dtype=bool)
+
+    # Episodes: a new one starts at each person's first Rx, or after a gap
+    new_person = np.diff(rx_person, prepend=-1) != 0
+    new_episode = new_person | (np.diff(rx_day, prepend=rx_day[:1]) > gap)
+    episode = np.cumsum(new_episode) - 1
+    last_rx = np.diff(episode, append=episode[-1:] + 1) != 0
+    episode_person = rx_person[new_episode]
+    episode_start = rx_day[new_episode]
+    episode_end = rx_day[last_rx] + gap
+
+    people["first_rx_day"] = first_per_person(rx_person, rx_day, every_rx, num_people)
+    people["last_rx_day"] = last_per_person(rx_person, rx_day, every_rx, num_people)
+    people["first_rx_wait"] = first_per_person(
+        rx_person, rx_day, (rx_day >= 0) & (rx_day <= wait_days[rx_person]), num_people
+    )
+    post = rx_day > wait_days[rx_person]
+    post_day = rx_day - wait_days[rx_person]
+    people["first_rx_post"] = first_per_person(rx_person, post_day, post, num_people)
+    people["last_rx_post"] = last_per_person(rx_person, post_day, post, num_people)
+    people["num_episodes"] = np.bincount(episode_person, minlength=num_people)
+
+    people["prior_rx_count"] = np.bincount(rx_person[(rx_day >= -182) & (rx_day < 0)], minlength=num_people)
+    people["prior_opioid_rx"] = people["prior_rx_count"] >= 3
+
+    # Long-term use: the last episode before RTT start, up to its last Rx
+    #   before RTT start, if still ongoing at RTT start
+    pre = np.flatnonzero(rx_day < 0)
+    pre_episode = episode[pre]
+    last_pre = np.diff(pre_episode, append=pre_episode[-1:] + 1) != 0
+    baseline = pre_episode[last_pre]
+    baseline_end = rx_day[pre[last_pre]] + gap
+    baseline_rx = np.bincount(pre_episode, minlength=len(episode_start))[baseline]
+    long_term = np.zeros(num_people, dtype=bool)
+    long_term[episode_person[baseline]] = (
+        (baseline_end >= 0)
+        & (baseline_rx >= min_rx)
+        & (np.minimum(baseline_end, 0) - episode_start[baseline] >= long_term_days)
+    )
+    people["long_term_episode"] = long_term
+
+    # Persistence: the episode ongoing at RTT end (at most one per person)
+    ongoing = (episode_start <= wait_days[episode_person]) & (episode_end > wait_days[episode_person])
+    exposure = np.zeros(num_people, dtype=np.int64)
+    exposure[episode_person[ongoing]] = (
+        np.minimum(episode_end[ongoing], end_days[episode_person[ongoing]]) - wait_days[episode_person[ongoing]]
+    )
+    people["post_exposure_days"] = np.maximum(exposure, 0)
+    people["persistent_post"] = people["post_exposure_days"] >= persistent_days
+
+    for column in ["first_rx_day", "last_rx_day", "first_rx_wait", "first_rx_post", "last_rx_post"]:
+        people[column] = people[column].astype("Int32")
+
+    return people
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default="output/data/opioid_rx")
+    parser.add_argument("--output", default="output/data/opioid_episodes.arrow")
+    parser.add_argument("--gap", type=int, default=GAP_DAYS, help="max days between Rx in an episode")
+    parser.add_argument("--min-rx", type=int, default=MIN_RX)
+    parser.add_argument("--long-term-days", type=int, default=LONG_TERM_DAYS)
+    parser.add_argument("--persistent-days", type=int, default=PERSISTENT_DAYS)
+
+    args = parser.parse_args()
+
+    people = read_arrow(Path(args.input_dir) / "dataset.arrow")
+    prescriptions = read_arrow(Path(args.input_dir) / "prescriptions.arrow")
+
+    episodes = opioid_episodes(people, prescriptions, gap=args.gap, min_rx=args.min_rx,
+                               long_term_days=args.long_term_days, persistent_days=args.persistent_days)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    write_arrow(pa.Table.from_pandas(episodes, preserve_index=False), args.output)
@@ -0,0 +1,19 @@
+##################################################################
+# Column groups of the orthopaedic dataset (dataset_definition_ortho.py)
+#
+# Each group is a module with an add_columns(dataset) function, and
+# only depends on the shared cohort table, so groups can be extracted
+# separately (--groups) and joined on patient_id by merge_dataset.py.
+# Changing one group then only means re-extracting that group.
+##################################################################
+
+
+# In dataset column order
+GROUPS = [
+    "waiting_list",
+    "admissions",
+    "censoring",
+    "medicines",
+    "demographics",
+    "clinical",
+]
@@ -0,0 +1,47 @@
+#### Admissions and orthopaedic procedures ####
+
+from ehrql import days
+from ehrql.tables.tpp import apcs
+
+import codelists
+from cohort import cohort_index
+
+
+def add_columns(dataset):
+
+    rtt_end_date = cohort_index.rtt_end_date
+
+    ### Admissions within 15 days of WL end - looked up once, all flags derive from these
+    admit_events = apcs.where(
+            apcs.admission_date.is_on_or_between(rtt_end_date - days(15), rtt_end_date + days(15))
+        )
+    admit_events.hrg_category = admit_events.spell_core_hrg_sus.map_values(codelists.hrg_category)
+
+    ### Any admission
+    dataset.any_admission = admit_events.exists_for_patient()
+
+    dataset.sameday_admission = admit_events.where(
+            admit_events.admission_date == rtt_end_date
+        ).exists_for_patient()
+
+    dataset.before_admission = admit_events.where(
+            admit_events.admission_date.is_before(rtt_end_date)
+        ).exists_for_patient()
+
+    dataset.after_admission = admit_events.where(
+            admit_events.admission_date.is_after(rtt_end_date)
+        ).exists_for_patient()
+
+    # dataset.admit_hrg = admit_events.sort_by(
+    #         admit_events.admission_date
+    #     ).first_for_patient().spell_core_hrg_sus
+
+    #### Orthopaedic procedures ####
+
+    for hrg in codelists.hrg_categories:
+
+        # Any admission for given orthopaedic procedures
+        hrg_query = admit_events.where(
+                admit_events.hrg_category == hrg
+            ).exists_for_patient()
+        dataset.add_column(f"{hrg}_hrg", hrg_query)
@@ -0,0 +1,19 @@
+#### Censoring dates ####
+
+from ehrql import days
+
+from cohort import cohort_index
+
+
+def add_columns(dataset):
+
+    # Registered 6 months before WL start, censored at death/deregistration/1 year after WL end
+    dataset.reg_end_date = cohort_index.reg_end_date
+    dataset.dod = cohort_index.dod
+    dataset.end_date = cohort_index.end_date
+
+    # Flag if censored before WL end date
+    dataset.censor_before_rtt_end = (cohort_index.end_date < cohort_index.rtt_end_date)
+
+    # Flag if censored before study end date (RTT end + 6 months)
+    dataset.censor_before_study_end = (cohort_index.end_date < cohort_index.rtt_end_date + days(365))
@@ -0,0 +1,49 @@
+#### Clinical characteristics ####
+
+from ehrql import years
+from ehrql.tables.tpp import clinical_events
+
+import codelists
+from cohort import cohort_index
+
+
+comorb_codes = {
+    "diabetes": "diabetes_codes",
+    "cardiac": "cardiac_codes",
+    "copd": "copd_codes",
+    "liver": "liver_codes",
+    "ckd": "ckd_codes",
+    "oa": "osteoarthritis_codes",
+    "ra": "ra_codes",
+    "depression": "depression_codes",
+    "anxiety": "anxiety_codes",
+    "smi": "smi_codes",
+    "oud": "oud_codes"
+    }
+
+
+def add_columns(dataset):
+
+    rtt_start_date = cohort_index.rtt_start_date
+
+    # All comorbidity (and cancer) events in past 5 years, from one scan of clinical events
+    #   classified with a bitmask of every comorbidity the code belongs to
+    clin_events_5yrs = clinical_events.where(
+            clinical_events.date.is_on_or_between(rtt_start_date - years(5), rtt_start_date)
+            & clinical_events.snomedct_code.is_in(codelists.comorbidity_class_index)
+        )
+    clin_events_5yrs.comorb_class = clin_events_5yrs.snomedct_code.to_category(codelists.comorbidity_class_index)
+
+    # Cancer diagnosis in past 5 years 
+    dataset.cancer = clin_events_5yrs.where(
+            clin_events_5yrs.comorb_class.is_in(codelists.comorbidity_class_masks("cancer_codes"))
+            & clin_events_5yrs.date.is_between_but_not_on(rtt_start_date - years(5), rtt_start_date)
+        ).exists_for_patient()
+
+    # Comorbidities in past 5 years
+    for comorb, comorb_codelist_name in comorb_codes.items():
+
+        snomed_query = clin_events_5yrs.where(
+                clin_events_5yrs.comorb_class.is_in(codelists.comorbidity_class_masks(comorb_codelist_name))
+            ).exists_for_patient()
+        dataset.add_column(comorb, snomed_query)
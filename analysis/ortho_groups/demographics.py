@@ -0,0 +1,66 @@
+#### Demographics ####
+
+from ehrql import case, when
+from ehrql.tables.tpp import (
+    patients,
+    addresses,
+    practice_registrations,
+    clinical_events)
+
+import codelists
+from cohort import cohort_index
+
+
+def add_columns(dataset):
+
+    rtt_start_date = cohort_index.rtt_start_date
+
+    age = patients.age_on(rtt_start_date)
+    dataset.age = age
+    dataset.age_group = case(
+            when(age < 40).then("18-39"),
+            when(age < 50).then("40-49"),
+            when(age < 60).then("50-59"),
+            when(age < 70).then("60-69"),
+            when(age < 80).then("70-79"),
+            when(age >= 80).then("80+"),
+            otherwise="Missing",
+    )
+    dataset.sex = patients.sex
+
+    # IMD decile
+    imd = addresses.for_patient_on(rtt_start_date).imd_rounded
+    dataset.imd10 = case(
+            when((imd >= 0) & (imd < int(32844 * 1 / 10))).then("1 (most deprived)"),
+            when(imd < int(32844 * 2 / 10)).then("2"),
+            when(imd < int(32844 * 3 / 10)).then("3"),
+            when(imd < int(32844 * 4 / 10)).then("4"),
+            when(imd < int(32844 * 5 / 10)).then("5"),
+            when(imd < int(32844 * 6 / 10)).then("6"),
+            when(imd < int(32844 * 7 / 10)).then("7"),
+            when(imd < int(32844 * 8 / 10)).then("8"),
+            when(imd < int(32844 * 9 / 10)).then("9"),
+            when(imd >= int(32844 * 9 / 10)).then("10 (least deprived)"),
+            otherwise="Unknown"
+    )
+
+    # Ethnicity 6 categories
+    ethnicity6 = clinical_events.where(
+            clinical_events.snomedct_code.is_in(codelists.ethnicity_codes_6)
+        ).where(
+            clinical_events.date.is_on_or_before(rtt_start_date)
+        ).sort_by(
+            clinical_events.date
+        ).last_for_patient().snomedct_code.to_category(codelists.ethnicity_codes_6)
+
+    dataset.ethnicity6 = case(
+        when(ethnicity6 == "1").then("White"),
+        when(ethnicity6 == "2").then("Mixed"),
+        when(ethnicity6 == "3").then("South Asian"),
+        when(ethnicity6 == "4").then("Black"),
+        when(ethnicity6 == "5").then("Other"),
+        when(ethnicity6 == "6").then("Not stated"),
+        otherwise="Unknown"
+    )
+
+    dataset.region = practice_registrations.for_patient_on(rtt_start_date).practice_nuts1_region_name
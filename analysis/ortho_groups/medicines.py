@@ -0,0 +1,78 @@
+#### Medicines data ####
+
+from ehrql import days, minimum_of
+from ehrql.tables.tpp import medications
+
+import codelists
+from cohort import cohort_index
+from windows import window_counts
+
+
+med_codes = {
+    "opioid": "opioid_codes",
+    "gabapentinoid": "gabapentinoid_codes",
+    "antidepressant": "antidepressant_codes",
+    "tca": "tca_codes",
+    "nsaid": "nsaid_codes",
+    "weak_opioid": "weak_opioid_codes",
+    "strong_opioid1": "strong_opioid_codes1",
+    "strong_opioid2": "strong_opioid_codes2",
+    "long_opioid": "long_opioid_codes",
+    "short_opioid": "short_opioid_codes",
+    "moderate_opioid": "moderate_opioid_codes"
+    }
+
+
+def add_columns(dataset):
+
+    rtt_start_date = cohort_index.rtt_start_date
+    rtt_end_date = cohort_index.rtt_end_date
+    end_date = cohort_index.end_date
+
+    # Prescribing windows: (count column, any column): (start, end[, condition])
+    med_windows = {
+        # During waiting list (this time period is variable, will account for this later)
+        ("wait_count", "wait_any"): (
+            rtt_start_date, minimum_of(end_date, rtt_end_date)
+        ),
+        # Before waiting list
+        ("pre_count1", "pre_any1"): (
+            rtt_start_date - days(182), rtt_start_date - days(1)
+        ),
+        # Before waiting list (90 days)
+        ("pre_count2", "pre_any2"): (
+            rtt_start_date - days(91), rtt_start_date - days(1)
+        ),
+        # After waiting list
+        ("post_count1", "post_any1"): (
+            rtt_end_date + days(91), minimum_of(rtt_end_date + days(273), end_date),
+            end_date > rtt_end_date
+        ),
+        # After waiting list (90 days)
+        ("post_count2", "post_any2"): (
+            rtt_end_date + days(91), minimum_of(rtt_end_date + days(182), end_date),
+            end_date > rtt_end_date
+        ),
+        }
+
+    # Classify each prescription against all drug classes with one lookup
+    #   (bitmask of every class the dm+d code belongs to)
+    med_rx = medications.where(medications.dmd_code.is_in(codelists.medication_class_index))
+    med_rx.med_class = med_rx.dmd_code.to_category(codelists.medication_class_index)
+
+    for med, med_codelist_name in med_codes.items():
+
+        med_events = med_rx.where(med_rx.med_class.is_in(codelists.medication_class_masks(med_codelist_name)))
+
+        # Number of prescriptions and any prescription in each window
+        for (count_name, any_name), (count_query, any_query) in window_counts(med_events, med_windows).items():
+            dataset.add_column(f"{med}_{count_name}", count_query)
+            dataset.add_column(f"{med}_{any_name}", any_query)
+
+    # Date of first prescription
+    dataset.first_opioid_date = med_events.where(
+                med_events.dmd_code.is_in(codelists.opioid_codes)
+                & med_events.date.is_on_or_between(rtt_start_date - days(365), minimum_of(end_date, rtt_end_date + days(365)))
+            ).sort_by(
+                med_events.date
+            ).first_for_patient().date
@@ -0,0 +1,22 @@
+#### Waiting list variables ####
+
+from cohort import cohort_index
+
+
+def add_columns(dataset):
+
+    # Latest waiting list and pathway counts, from the shared cohort table
+    for column in ["count_rtt_rows", "count_rtt_start_date", "count_patient_id",
+                   "count_organisation_id", "count_referral_id"]:
+        dataset.add_column(column, getattr(cohort_index, column))
+
+    # RTT waiting list start date and end date
+    dataset.rtt_start_date = cohort_index.rtt_start_date
+    dataset.rtt_end_date = cohort_index.rtt_end_date
+    dataset.wait_time = (cohort_index.rtt_end_date - cohort_index.rtt_start_date).days
+    dataset.num_weeks = (cohort_index.rtt_end_date - cohort_index.rtt_start_date).weeks
+
+    # Other relevant columns
+    dataset.treatment_function = cohort_index.treatment_function
+    dataset.waiting_list_type = cohort_index.waiting_list_type
+    dataset.priority_type = cohort_index.priority_type
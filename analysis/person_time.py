@@ -0,0 +1,133 @@
+###########################################################
+# This script counts opioid prescriptions and person-days at
+#   risk before, during and after the waiting list, for the
+#   routine/admitted orthopaedic cohort, overall and by each
+#   stratifier (replaces ptime() in custom_functions.R)
+#
+# Person-days cover the same windows as the prescription counts
+#   in the ortho dataset (see ortho_groups/medicines.py),
+#   censored at end_date. Every stratifier is aggregated in one
+#   group-by, and counts are rounded as in rounding() in
+#   custom_functions.R
+###########################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from helpers import rounding
+
+
+COHORT = "Orthopaedic - Routine/Admitted"
+
+# Measure label: count column prefix in the ortho dataset
+MEASURES = {
+    "Any opioid": "opioid",
+    "Short-acting opioid": "short_opioid",
+    "Long-acting opioid": "long_opioid",
+    "Weak opioid": "weak_opioid",
+    "Moderate opioid": "moderate_opioid",
+    "Strong opioid": "strong_opioid1",
+    "Strong opioid 2": "strong_opioid2",
+}
+
+# Period label: (count column suffix, person-days at risk from days since
+#   RTT start of: RTT end (wait) and end date (end))
+PERIODS = {
+    # 182 days before RTT start
+    "Pre-WL": ("pre_count1", lambda wait, end: np.full_like(wait, 182)),
+    # RTT start to RTT end, censored at end date
+    "During WL": ("wait_count", lambda wait, end: np.maximum(np.minimum(end, wait) + 1, 0)),
+    # 91 to 273 days after RTT end, censored at end date
+    "Post WL": ("post_count1", lambda wait, end: np.clip(np.minimum(wait + 273, end) - (wait + 91) + 1, 0, None)),
+}
+
+# Stratifier column: variable label
+STRATIFIERS = {
+    "full": "Full cohort",
+    "age_group": "Age",
+    "sex": "Sex",
+    "imd10": "IMD",
+    "ethnicity6": "Ethnicity",
+    "region": "Region",
+    "prior_opioid_rx": "Prior opioid Rx",
+    "wait_gp": "Time on waiting list",
+    "oa": "OA diagnosis",
+    "hip_hrg": "Hip HRG",
+    "knee_hrg": "Knee HRG",
+}
+
+
+def read_cohort(path):
+    # Only the columns needed
+    columns = (
+        ["rtt_start_date", "rtt_end_date", "end_date"]
+        + [column for column in STRATIFIERS if column != "full"]
+        + [f"{prefix}_{suffix}" for prefix in MEASURES.values() for suffix, _ in PERIODS.values()]
+    )
+    return feather.read_table(str(path), columns=columns, memory_map=True).to_pandas()
+
+
+def person_time(cohort):
+    """Rounded prescription counts and person-days per period, measure
+    and stratifier category."""
+    start = pd.to_datetime(cohort["rtt_start_date"])
+    wait = (pd.to_datetime(cohort["rtt_end_date"]) - start).dt.days.to_numpy()
+    end = (pd.to_datetime(cohort["end_date"]) - start).dt.days.to_numpy()
+
+    # One column per period (person-days) and period x measure (Rx)
+    values = {}
+    for period, (suffix, at_risk) in PERIODS.items():
+        values[f"person_days {period}"] = at_risk(wait, end)
+        for measure, prefix in MEASURES.items():
+            values[f"count_rx {period} {measure}"] = cohort[f"{prefix}_{suffix}"].to_numpy()
+    values = pd.DataFrame(values)
+
+    # Categories as text, with TRUE/FALSE as Yes/No
+    categories = {"full": pd.Series("Full cohort", index=cohort.index)}
+    for column in STRATIFIERS:
+        if column != "full":
+            category = cohort[column]
+            if category.dtype == bool:
+                category = category.map({True: "Yes", False: "No"})
+            categories[column] = category.astype("string")
+
+    # Every stratifier stacked, so one group-by covers them all
+    stacked = pd.concat(
+        [values.assign(variable=STRATIFIERS[column], category=category.to_numpy())
+         for column, category in categories.items()],
+        ignore_index=True,
+    )
+    sums = stacked.groupby(["variable", "category"], dropna=False, sort=False).sum()
+
+    # Long format: one row per category, period and measure
+    rows = []
+    for period in PERIODS:
+        person_days = rounding(sums[f"person_days {period}"])
+        for measure in MEASURES:
+            rows.append(pd.DataFrame({
+                "cohort": COHORT,
+                "variable": sums.index.get_level_values("variable"),
+                "category": sums.index.get_level_values("category"),
+                "period": period,
+                "measure": measure,
+                "person_days": person_days,
+                "count_rx": rounding(sums[f"count_rx {period} {measure}"]),
+            }))
+    return pd.concat(rows, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--cohort", default="output/data/cohort_ortho_routine_clockstops.arrow")
+    parser.add_argument("--output", default="output/clockstops/person_time.csv")
+
+    args = parser.parse_args()
+
+    result = person_time(read_cohort(args.cohort))
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    result.to_csv(args.output, index=False, na_rep="NA")
@@ -0,0 +1,127 @@
+###########################################################
+# This script builds a sparse matrix of prescription counts
+#   per person x relative week x drug class, from the Rx
+#   extracted by dataset_definition_opioid_rx.py, so weekly
+#   rates, stratifications and windows can be computed in
+#   memory without going back to the medications table
+#
+# Weeks run from -26, relative to two anchors:
+#   rtt_start - week 0 starts on the RTT start date, up to week
+#     104 (waits of up to 2 years)
+#   rtt_end - week 0 starts on the day after the RTT end date,
+#     up to week 51
+#   (weeks start on the same days as in the pre/during/post WL
+#   measures)
+# Rx are extracted up to 365 days after RTT end, so week 51
+#   (days 357-363 from the day after RTT end) is the last whole
+#   week after RTT end. Weeks from RTT start go further, and
+#   each person's weeks at risk (followup_weeks) stop at their
+#   censoring date, which is at most 365 days after RTT end
+#
+# Outputs (in --output-dir):
+#   rx_matrix.arrow - COO entries: row (person), anchor, week,
+#     drug_class, rx_count (only non-zero counts)
+#   rx_matrix_people.arrow - one row per person (row order),
+#     with WL/censoring offsets, weeks at risk, grouping
+#     variables and opioid episodes (opioid_episodes.py)
+###########################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+from aligned_measures import weeks_at_risk
+from helpers import person_rows, read_arrow, write_arrow
+
+
+FIRST_WEEK = -26
+
+# Anchor name -> (day 0 of week 0, in days from RTT start, last week)
+ANCHORS = {
+    "rtt_start": (lambda days: 0, 104),
+    "rtt_end": (lambda days: days["wait_days"] + 1, 51),
+}
+
+
+def build_rx_matrix(people, prescriptions, class_names):
+    """COO entries of Rx counts, and the people table (in row order)."""
+    people = people.sort_values("patient_id").reset_index(drop=True)
+    rx_person = person_rows(people["patient_id"].to_numpy(), prescriptions["patient_id"].to_numpy())
+    rx_day = prescriptions["rx_day"].to_numpy(dtype=np.int64)
+    days = {column: people[column].to_numpy(dtype=np.int64) for column in ["wait_days", "end_days"]}
+
+    num_anchors = len(ANCHORS)
+    num_weeks = max(last_week for _, last_week in ANCHORS.values()) - FIRST_WEEK + 1
+    num_classes = len(class_names)
+
+    # Encode each (row, anchor, week, class) as one integer, then count
+    #   them all at once
+    keys = []
+    for anchor_index, (anchor_day, last_week) in enumerate(ANCHORS.values()):
+        week = np.floor_divide(rx_day - np.broadcast_to(anchor_day(days), len(people))[rx_person], 7)
+        in_range = (week >= FIRST_WEEK) & (week <= last_week)
+        for class_index, class_name in enumerate(class_names):
+            selected = in_range & prescriptions[class_name].fillna(False).to_numpy(dtype=bool)
+            keys.append(
+                ((rx_person[selected] * num_anchors + anchor_index) * num_weeks
+                 + (week[selected] - FIRST_WEEK)) * num_classes + class_index
+            )
+    keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+
+    class_index, keys = keys % num_classes, keys // num_classes
+    week, keys = keys % num_weeks + FIRST_WEEK, keys // num_weeks
+    anchor_index, row = keys % num_anchors, keys // num_anchors
+
+    matrix = pa.table({
+        "row": pa.array(row, pa.int32()),
+        "anchor": pa.DictionaryArray.from_arrays(pa.array(anchor_index, pa.int8()), list(ANCHORS)),
+        "week": pa.array(week, pa.int16()),
+        "drug_class": pa.DictionaryArray.from_arrays(pa.array(class_index, pa.int8()), class_names),
+        "rx_count": pa.array(counts, pa.int32()),
+    })
+
+    # Weeks at risk (denominator), for each period
+    start_weeks = ANCHORS["rtt_start"][1] + 1
+    people["wait_weeks"] = weeks_at_risk(np.minimum(days["end_days"], days["wait_days"]), start_weeks)
+    people["post_weeks"] = weeks_at_risk(days["end_days"] - days["wait_days"], ANCHORS["rtt_end"][1] + 1)
+    people["followup_weeks"] = weeks_at_risk(days["end_days"], start_weeks)
+
+    return matrix, people
+
+
+def read_rx_matrix(directory):
+    """The matrix entries and people table, as pandas DataFrames."""
+    directory = Path(directory)
+    return read_arrow(directory / "rx_matrix.arrow"), read_arrow(directory / "rx_matrix_people.arrow")
+
+
+def dense(matrix, num_people, anchor, drug_class):
+    """Rx counts for one anchor and drug class, as a people x weeks
+    array (column 0 is FIRST_WEEK, the last column the anchor's last week)."""
+    entries = matrix[(matrix["anchor"] == anchor) & (matrix["drug_class"] == drug_class)]
+    counts = np.zeros((num_people, ANCHORS[anchor][1] - FIRST_WEEK + 1), dtype=np.int32)
+    counts[entries["row"].to_numpy(), entries["week"].to_numpy() - FIRST_WEEK] = entries["rx_count"].to_numpy()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default="output/data/opioid_rx")
+    parser.add_argument("--episodes", default="output/data/opioid_episodes.arrow",
+                        help="people, with opioid episodes (from opioid_episodes.py)")
+    parser.add_argument("--output-dir", default="output/data/rx_matrix")
+
+    args = parser.parse_args()
+
+    people = read_arrow(args.episodes)
+    prescriptions = read_arrow(Path(args.input_dir) / "prescriptions.arrow")
+    class_names = [column for column in prescriptions.columns if column not in ("patient_id", "rx_day")]
+
+    matrix, people = build_rx_matrix(people, prescriptions, class_names)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    write_arrow(matrix, output_dir / "rx_matrix.arrow")
+    write_arrow(pa.Table.from_pandas(people, preserve_index=False), output_dir / "rx_matrix_people.arrow")
@@ -0,0 +1,204 @@
+###########################################################
+# This script runs window sensitivity analyses: opioid Rx
+#   counts and person-days before, during and after the waiting
+#   list, for every combination of window parameters in a grid,
+#   from the one extract by dataset_definition_opioid_rx.py
+#   (prescriptions, admissions and OA diagnoses, as days
+#   relative to RTT start/end)
+#
+# Each table's events are sorted once by person and day, and
+#   every window is a binary search of that array, so a grid of
+#   parameter sets costs about as much as one. Each distinct
+#   window is only counted once, however many sets use it.
+#
+# Parameters (defaults are the main analysis windows):
+#   pre_days - Rx in the pre_days before RTT start (max 365)
+#   post_start, post_end - Rx from post_start to post_end days
+#     after RTT end (max 365)
+#   followup_days - censoring cap, days after RTT end
+#   admission_days - hip/knee HRG admission within this many
+#     days of RTT end (max 60)
+#   oa_lookback_days - OA diagnosis in this many days before RTT
+#     start (max 3652)
+#   min_rx - prior_opioid_rx is at least min_rx Rx pre-WL
+#
+# The grid is a JSON file of parameter: list of values (missing
+#   parameters take their default). Output has one row per
+#   parameter set (set_id, and its parameters) and stratifier
+#   category, with counts rounded as in custom_functions.R
+###########################################################
+
+import itertools
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from helpers import person_rows, read_arrow, rounding
+
+
+# Parameter: default
+PARAMETERS = {
+    "pre_days": 182,
+    "post_start": 91,
+    "post_end": 273,
+    "followup_days": 365,
+    "admission_days": 15,
+    "oa_lookback_days": 1826,
+    "min_rx": 3,
+}
+
+# Widest windows in the extract (see dataset_definition_opioid_rx.py)
+LIMITS = {
+    "pre_days": 365,
+    "post_end": 365,
+    "followup_days": 365,
+    "admission_days": 60,
+    "oa_lookback_days": 3652,
+}
+
+# Stratifier column: variable label
+STRATIFIERS = {
+    "full": "Full cohort",
+    "prior_opioid_rx": "Prior opioid Rx",
+    "oa_diagnosis": "OA diagnosis",
+    "hip_hrg": "Hip HRG",
+    "knee_hrg": "Knee HRG",
+}
+
+
+class EventDays:
+    """One table's events, sorted by person and day, for counting each
+    person's events in a window."""
+
+    def __init__(self, event_person, event_day, num_people):
+        # Encode (person, day) as one sortable integer, with days offset
+        #   so every window bound fits between two people's keys
+        self.first = event_day.min() - 1 if len(event_day) else 0
+        self.span = event_day.max() - self.first + 2 if len(event_day) else 2
+        self.keys = np.sort(event_person * self.span + (event_day - self.first))
+        self.people = np.arange(num_people) * self.span
+
+    def count(self, lower, upper):
+        """Events per person from day lower to day upper (inclusive)."""
+        valid = upper >= lower
+        lower = np.clip(lower - self.first, 0, self.span - 1)
+        upper = np.clip(upper - self.first, 0, self.span - 1)
+        counts = (np.searchsorted(self.keys, self.people + upper, side="right")
+                  - np.searchsorted(self.keys, self.people + lower, side="left"))
+        return np.where(valid, counts, 0)
+
+
+def parameter_sets(grid):
+    """Every combination of the grid's values, as dicts of all parameters."""
+    unknown = set(grid) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"unknown window parameters: {', '.join(sorted(unknown))}")
+
+    values = [grid.get(name, [default]) for name, default in PARAMETERS.items()]
+    sets = [dict(zip(PARAMETERS, combination)) for combination in itertools.product(*values)]
+
+    for parameters in sets:
+        for name, limit in LIMITS.items():
+            if parameters[name] > limit:
+                raise ValueError(f"{name}={parameters[name]} is beyond the extract (max {limit})")
+    return sets
+
+
+def window_sweep(people, prescriptions, admissions, oa_diagnoses, sets):
+    people = people.sort_values("patient_id").reset_index(drop=True)
+    patient_ids = people["patient_id"].to_numpy()
+    num_people = len(people)
+    wait = people["wait_days"].to_numpy(dtype=np.int64)
+    end_days = people["end_days"].to_numpy(dtype=np.int64)
+
+    def events(table, day_column, selected=None):
+        if selected is not None:
+            table = table[selected]
+        return EventDays(person_rows(patient_ids, table["patient_id"].to_numpy()),
+                         table[day_column].to_numpy(dtype=np.int64), num_people)
+
+    rx = events(prescriptions, "rx_day")
+    hip = events(admissions, "admission_day", admissions["hrg_category"] == "hip")
+    knee = events(admissions, "admission_day", admissions["hrg_category"] == "knee")
+    oa = events(oa_diagnoses, "diagnosis_day")
+
+    # Window counts, shared between sets with the same window
+    counted = {}
+
+    def count(event_days, name, lower, upper, *key):
+        if (name, *key) not in counted:
+            counted[(name, *key)] = event_days.count(lower, upper)
+        return counted[(name, *key)]
+
+    stacked = []
+    for set_id, parameters in enumerate(sets, start=1):
+        pre_days, post_start, post_end, followup_days, admission_days, oa_lookback_days, min_rx = (
+            parameters[name] for name in PARAMETERS
+        )
+        end = np.minimum(end_days, wait + followup_days)
+        wait_end = np.minimum(end, wait)
+        post_end_day = np.minimum(wait + post_end, end)
+
+        pre_rx = count(rx, "pre", np.full(num_people, -pre_days), np.full(num_people, -1), pre_days)
+        post_rx = count(rx, "post", wait + post_start, post_end_day, post_start, post_end, followup_days)
+        values = pd.DataFrame({
+            "people": 1,
+            "pre_rx": pre_rx,
+            "wait_rx": count(rx, "wait", np.zeros(num_people, dtype=np.int64), wait_end, followup_days),
+            "wait_days": np.maximum(wait_end + 1, 0),
+            "post_rx": post_rx,
+            "post_days": np.maximum(post_end_day - (wait + post_start) + 1, 0),
+            "any_post_rx": post_rx > 0,
+        })
+
+        within = np.full(num_people, admission_days)
+        categories = {
+            "full": np.full(num_people, "Full cohort", dtype=object),
+            "prior_opioid_rx": pre_rx >= min_rx,
+            "oa_diagnosis": count(oa, "oa", np.full(num_people, -oa_lookback_days), np.zeros(num_people, dtype=np.int64),
+                                  oa_lookback_days) > 0,
+            "hip_hrg": count(hip, "hip", -within, within, admission_days) > 0,
+            "knee_hrg": count(knee, "knee", -within, within, admission_days) > 0,
+        }
+        for column, category in categories.items():
+            if category.dtype == bool:
+                category = np.where(category, "Yes", "No")
+            stacked.append(values.assign(set_id=set_id, variable=STRATIFIERS[column], category=category))
+
+    # Every set and stratifier in one group-by
+    sums = pd.concat(stacked, ignore_index=True).groupby(
+        ["set_id", "variable", "category"], sort=False
+    ).sum().reset_index()
+
+    for column in ["people", "pre_rx", "wait_rx", "wait_days", "post_rx", "post_days", "any_post_rx"]:
+        sums[column] = rounding(sums[column])
+
+    parameters = pd.DataFrame(sets).assign(set_id=range(1, len(sets) + 1))
+    return parameters.merge(sums, on="set_id")[["set_id", *PARAMETERS, *sums.columns.drop("set_id")]]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default="output/data/opioid_rx")
+    parser.add_argument("--grid", default="analysis/window_grid.json")
+    parser.add_argument("--output", default="output/sensitivity/window_sweep.csv")
+
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        sets = parameter_sets(json.load(f))
+
+    input_dir = Path(args.input_dir)
+    result = window_sweep(
+        read_arrow(input_dir / "dataset.arrow"),
+        read_arrow(input_dir / "prescriptions.arrow"),
+        read_arrow(input_dir / "admissions.arrow"),
+        read_arrow(input_dir / "oa_diagnoses.arrow"),
+        sets,
+    )
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    result.to_csv(args.output, index=False, na_rep="NA")
@@ -0,0 +1,36 @@
+##################################################################
+# Helpers for counting events in date windows relative to each
+# person's waiting list dates (e.g. pre-WL, during WL, post-WL)
+##################################################################
+
+
+from ehrql import minimum_of, maximum_of
+
+
+def window_counts(events, windows):
+    """Count events in each window, and flag any event in each window.
+
+    `windows` maps a window name to a (start, end) pair of patient-level
+    dates, optionally followed by an extra patient-level condition. Events
+    are first restricted to the span covering all windows, and both the
+    count and the any-flag for a window come from the same filtered
+    events. Returns a dict of window name to (count, any) series.
+    """
+    starts = [window[0] for window in windows.values()]
+    ends = [window[1] for window in windows.values()]
+
+    if len(windows) > 1:
+        events = events.where(
+            events.date.is_on_or_between(minimum_of(*starts), maximum_of(*ends))
+        )
+
+    counts = {}
+    for name, (start, end, *condition) in windows.items():
+        in_window = events.date.is_on_or_between(start, end)
+        for extra in condition:
+            in_window = in_window & extra
+
+        count = events.where(in_window).count_for_patient()
+        counts[name] = (count, count > 0)
+
+    return counts
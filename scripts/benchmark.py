@@ -0,0 +1,163 @@
+###########################################################
+# This script benchmarks each dataset and measures definition
+#   at a range of dummy data population sizes, using ehrQL's
+#   local in-memory query engine.
+# It records wall time, peak memory (RSS) and output size,
+#   and writes the results to a JSON file so they can be
+#   compared between commits.
+#
+# Run locally from the repository root, e.g.:
+#   python scripts/benchmark.py --sizes 1000 10000 100000
+###########################################################
+
+import datetime
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+
+# name: (ehrql command, definition, user arguments)
+#   cohort_index runs first, as the ortho dataset and opioid measures read its output
+DEFINITIONS = {
+    "cohort_index": ("generate-dataset", "analysis/dataset_definition_cohort.py", []),
+    "dataset_full": ("generate-dataset", "analysis/dataset_definition_full.py", []),
+    "dataset_ortho": ("generate-dataset", "analysis/dataset_definition_ortho.py", []),
+    "clockstops": ("generate-dataset", "analysis/dataset_definition_clockstops.py", []),
+    "opioid_rx": ("generate-dataset", "analysis/dataset_definition_opioid_rx.py", []),
+    "measures_opioid": ("generate-measures", "analysis/measures_opioid.py", []),
+}
+
+# Definitions with event tables, written as a directory of Arrow files
+MULTI_TABLE = {"clockstops", "opioid_rx"}
+
+# Output of cohort_index, read by other definitions (see analysis/cohort.py)
+COHORT_INDEX_PATH = Path("output/data/cohort_index.arrow")
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def with_population_size(definition, population_size):
+    """Copy a definition, replacing its dummy data population size.
+
+    The copy sits next to the original so local imports (codelists etc.)
+    still resolve."""
+    source = Path(definition)
+    text, n = re.subn(
+        r"population_size\s*=\s*\d+", f"population_size={population_size}", source.read_text()
+    )
+    if n == 0:
+        raise ValueError(f"{definition} does not configure a dummy data population size")
+    copy = source.with_name(f".benchmark_{source.name}")
+    copy.write_text(text)
+    return copy
+
+
+def run_and_measure(command):
+    """Run a command, returning its exit code, wall time, peak RSS (MB) and stderr."""
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 gives resource usage for this child only
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr.seek(0)
+        stderr_text = stderr.read().decode(errors="replace")
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return process.returncode, wall_seconds, usage.ru_maxrss / scale, stderr_text
+
+
+def benchmark(name, population_size, ehrql, output_dir):
+    command, definition, user_args = DEFINITIONS[name]
+    if name == "cohort_index":
+        output = output_arg = COHORT_INDEX_PATH
+    elif name in MULTI_TABLE:
+        output = output_dir / f"{name}_{population_size}"
+        output_arg = f"{output}:arrow"
+    else:
+        suffix = ".arrow" if command == "generate-dataset" else ".csv"
+        output = output_arg = output_dir / f"{name}_{population_size}{suffix}"
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    copy = with_population_size(definition, population_size)
+    try:
+        returncode, wall_seconds, peak_rss_mb, stderr = run_and_measure(
+            [*ehrql, command, str(copy), "--output", str(output_arg), *(["--", *user_args] if user_args else [])]
+        )
+    finally:
+        copy.unlink()
+
+    if returncode != 0:
+        print(stderr, file=sys.stderr)
+
+    return {
+        "definition": name,
+        "population_size": population_size,
+        "returncode": returncode,
+        "wall_seconds": round(wall_seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "output_bytes": output_size(output) if returncode == 0 and output.exists() else None,
+    }
+
+
+def output_size(output):
+    """Size of an output file, or of all the files in an output directory."""
+    if output.is_dir():
+        return sum(path.stat().st_size for path in output.iterdir() if path.is_file())
+    return output.stat().st_size
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--definitions", nargs="+", choices=DEFINITIONS, default=list(DEFINITIONS))
+    parser.add_argument("--ehrql", default="ehrql", help="command used to run ehrQL")
+    parser.add_argument("--output-dir", type=Path, default=Path("output/benchmarks"))
+
+    args = parser.parse_args()
+
+    # Don't clobber an existing cohort index (e.g. from a real local run)
+    backup = None
+    restore_cohort_index = "cohort_index" in args.definitions
+    if restore_cohort_index and COHORT_INDEX_PATH.exists():
+        backup = Path(tempfile.mkdtemp()) / COHORT_INDEX_PATH.name
+        shutil.move(COHORT_INDEX_PATH, backup)
+
+    results = []
+    try:
+        for population_size in args.sizes:
+            for name in args.definitions:
+                result = benchmark(name, population_size, shlex.split(args.ehrql), args.output_dir)
+                print(
+                    f"{name:<22} {population_size:>9,}  {result['wall_seconds']:>9.1f}s  "
+                    f"{result['peak_rss_mb']:>8.0f} MB  {result['output_bytes'] or 0:>12,} bytes"
+                )
+                results.append(result)
+    finally:
+        if backup is not None:
+            shutil.move(backup, COHORT_INDEX_PATH)
+        elif restore_cohort_index:
+            COHORT_INDEX_PATH.unlink(missing_ok=True)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    results_file = args.output_dir / "benchmark_results.json"
+    results_file.write_text(json.dumps({
+        "commit": git_commit(),
+        "run_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {results_file}")
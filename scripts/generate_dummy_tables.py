@@ -0,0 +1,476 @@
+###########################################################
+# This script generates synthetic TPP tables at production-like
+#   volume, for use with ehrQL's --dummy-tables option, e.g.:
+#
+#   python scripts/generate_dummy_tables.py --patients 1000000 --output dummy/tables
+#   ehrql generate-dataset analysis/dataset_definition_cohort.py \
+#     --dummy-tables dummy/tables --output output/data/cohort_index.arrow
+#
+# Tables written: patients, practice_registrations, addresses,
+#   wl_clockstops, medications, clinical_events and apcs.
+# Values are drawn to look like the study data: RTT pathway lengths,
+#   share of orthopaedic (110) pathways, admitted waiting list types,
+#   prescriptions and diagnoses from our codelists (read straight
+#   from the CSVs, so ehrQL isn't needed), and HRG codes from the
+#   codelists HRG lists.
+# Patients are generated in batches and each batch is appended to
+#   the Arrow files, so memory use does not grow with table size.
+# Output is reproducible for a given --seed and --batch-size.
+###########################################################
+
+import csv
+import datetime
+import functools
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+ROOT = Path(__file__).parents[1]
+
+sys.path.insert(0, str(ROOT / "analysis"))
+import codelists  # noqa: E402
+
+
+STUDY_START = np.datetime64("2021-05-01")
+STUDY_END = np.datetime64("2022-04-30")
+
+# Prescriptions and diagnoses are spread over this period
+EVENTS_START = np.datetime64("2015-01-01")
+EVENTS_END = np.datetime64("2023-12-31")
+
+SEXES = (["female", "male", "intersex", "unknown"], [0.495, 0.495, 0.002, 0.008])
+
+REGIONS = ["North East", "North West", "Yorkshire and The Humber", "East Midlands",
+           "West Midlands", "East", "London", "South East", "South West"]
+
+# Treatment functions other than trauma & orthopaedics (110)
+OTHER_TREATMENT_FUNCTIONS = ["100", "101", "108", "111", "115", "120", "130", "140", "150",
+                             "160", "170", "300", "301", "320", "330", "340", "400", "410",
+                             "430", "502"]
+
+ADMITTED_TYPES = (["IRTT", "PTLI", "RTTI"], [0.9, 0.05, 0.05])
+NOT_ADMITTED_TYPES = (["ORTT", "PTLO", "RTTO"], [0.9, 0.05, 0.05])
+PRIORITY_TYPES = (["routine", "urgent", "two week wait"], [0.8, 0.15, 0.05])
+
+# Share of prescriptions by medication class
+MEDICATION_CLASS_WEIGHTS = {
+    "opioid_codes": 0.4,
+    "nsaid_codes": 0.25,
+    "antidepressant_codes": 0.15,
+    "gabapentinoid_codes": 0.1,
+    "tca_codes": 0.1,
+}
+
+# Prevalence of each comorbidity (in the 5 years before the study)
+COMORBIDITY_PREVALENCE = {
+    "cancer_codes": 0.05,
+    "diabetes_codes": 0.08,
+    "cardiac_codes": 0.06,
+    "copd_codes": 0.04,
+    "liver_codes": 0.01,
+    "ckd_codes": 0.05,
+    "osteoarthritis_codes": 0.15,
+    "ra_codes": 0.01,
+    "depression_codes": 0.12,
+    "anxiety_codes": 0.10,
+    "smi_codes": 0.01,
+    "oud_codes": 0.005,
+}
+
+# Procedure mix for orthopaedic admissions
+HRG_CATEGORY_WEIGHTS = {
+    "hip": 0.25, "knee": 0.25, "hand": 0.1, "foot": 0.1, "shoulder": 0.1,
+    "elbow": 0.03, "complex": 0.02, "pain": 0.05, "trauma": 0.1,
+}
+
+
+SCHEMAS = {
+    "patients": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date_of_birth", pa.date32()),
+        ("sex", pa.string()),
+        ("date_of_death", pa.date32()),
+    ]),
+    "practice_registrations": pa.schema([
+        ("patient_id", pa.int64()),
+        ("start_date", pa.date32()),
+        ("end_date", pa.date32()),
+        ("practice_pseudo_id", pa.int64()),
+        ("practice_stp", pa.string()),
+        ("practice_nuts1_region_name", pa.string()),
+    ]),
+    "addresses": pa.schema([
+        ("patient_id", pa.int64()),
+        ("address_id", pa.int64()),
+        ("start_date", pa.date32()),
+        ("end_date", pa.date32()),
+        ("address_type", pa.int64()),
+        ("rural_urban_classification", pa.int64()),
+        ("imd_rounded", pa.int64()),
+        ("msoa_code", pa.string()),
+        ("has_postcode", pa.bool_()),
+        ("care_home_is_potential_match", pa.bool_()),
+        ("care_home_requires_nursing", pa.bool_()),
+        ("care_home_does_not_require_nursing", pa.bool_()),
+    ]),
+    "wl_clockstops": pa.schema([
+        ("patient_id", pa.int64()),
+        ("activity_treatment_function_code", pa.string()),
+        ("priority_type_code", pa.string()),
+        ("pseudo_organisation_code_patient_pathway_identifier_issuer", pa.string()),
+        ("pseudo_patient_pathway_identifier", pa.string()),
+        ("pseudo_referral_identifier", pa.string()),
+        ("referral_request_received_date", pa.date32()),
+        ("referral_to_treatment_period_end_date", pa.date32()),
+        ("referral_to_treatment_period_start_date", pa.date32()),
+        ("source_of_referral_for_outpatients", pa.string()),
+        ("waiting_list_type", pa.string()),
+        ("week_ending_date", pa.date32()),
+    ]),
+    "medications": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date", pa.date32()),
+        ("dmd_code", pa.string()),
+        ("consultation_id", pa.int64()),
+    ]),
+    "clinical_events": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date", pa.date32()),
+        ("snomedct_code", pa.string()),
+        ("ctv3_code", pa.string()),
+        ("numeric_value", pa.float64()),
+        ("consultation_id", pa.int64()),
+    ]),
+    "apcs": pa.schema([
+        ("patient_id", pa.int64()),
+        ("apcs_ident", pa.int64()),
+        ("admission_date", pa.date32()),
+        ("discharge_date", pa.date32()),
+        ("admission_method", pa.string()),
+        ("discharge_destination", pa.string()),
+        ("patient_classification", pa.string()),
+        ("spell_core_hrg_sus", pa.string()),
+        ("all_diagnoses", pa.string()),
+        ("primary_diagnosis", pa.string()),
+        ("secondary_diagnosis", pa.string()),
+        ("all_procedures", pa.string()),
+    ]),
+}
+
+
+def align_with_ehrql(schemas):
+    """Match the columns the installed ehrQL version expects for each table.
+
+    Columns we don't generate are added as nulls, and columns ehrQL doesn't
+    know about are dropped. If ehrQL isn't installed, the schemas above are
+    used as they are."""
+    try:
+        from ehrql.tables import tpp
+    except ImportError:
+        return schemas
+
+    arrow_types = {bool: pa.bool_(), int: pa.int64(), float: pa.float64(), datetime.date: pa.date32()}
+    aligned = {}
+    for name, schema in schemas.items():
+        try:
+            ehrql_schema = getattr(tpp, name)._qm_node.schema
+        except AttributeError:
+            aligned[name] = schema
+            continue
+        schema = pa.schema([
+            field for field in schema
+            if field.name == "patient_id" or field.name in ehrql_schema.column_names
+        ])
+        for column in ehrql_schema.column_names:
+            if column not in schema.names:
+                column_type = ehrql_schema.get_column_type(column)
+                schema = schema.append(pa.field(column, arrow_types.get(column_type, pa.string())))
+        aligned[name] = schema
+    return aligned
+
+
+def random_dates(rng, start, end, size):
+    days = (end - start).astype(int)
+    return start + rng.integers(0, days + 1, size).astype("timedelta64[D]")
+
+
+@functools.cache
+def codelist_codes(name):
+    """Codes in one of our codelists (see codelists.py), read from its CSV."""
+    if name in codelists.CSV_CODELISTS:
+        filename, column, _ = codelists.CSV_CODELISTS[name]
+        with open(ROOT / filename, newline="") as f:
+            return [row[column].strip() for row in csv.DictReader(f) if row[column].strip()]
+    sources, build = codelists.DERIVED_CODELISTS[name]
+    return list(build(*[codelist_codes(source) for source in sources]))
+
+
+def codes_from(rng, codelist_names, weights, size):
+    """Draw codes: pick a codelist by weight, then a code uniformly from it."""
+    pools = [np.array(sorted(codelist_codes(name))) for name in codelist_names]
+    weights = np.array(weights, dtype=float) / sum(weights)
+    which = rng.choice(len(pools), size, p=weights)
+    codes = np.empty(size, dtype=object)
+    for i, pool in enumerate(pools):
+        mask = which == i
+        codes[mask] = pool[rng.integers(0, len(pool), mask.sum())]
+    return codes
+
+
+def patients_batch(rng, patient_ids):
+    n = len(patient_ids)
+    age_days = rng.integers(18 * 365, 95 * 365, n).astype("timedelta64[D]")
+    date_of_birth = (STUDY_START - age_days).astype("datetime64[M]").astype("datetime64[D]")
+    dies = rng.random(n) < 0.02
+    return {
+        "patient_id": patient_ids,
+        "date_of_birth": date_of_birth,
+        "sex": rng.choice(SEXES[0], n, p=SEXES[1]),
+        "date_of_death": (random_dates(rng, STUDY_START, EVENTS_END, n), dies),
+    }
+
+
+def registrations_batch(rng, patient_ids):
+    n = len(patient_ids)
+    leaves = rng.random(n) < 0.05
+    practice = rng.integers(1, 6000, n)
+    return {
+        "patient_id": patient_ids,
+        "start_date": random_dates(rng, np.datetime64("1990-01-01"), np.datetime64("2020-10-31"), n),
+        "end_date": (random_dates(rng, STUDY_START, EVENTS_END, n), leaves),
+        "practice_pseudo_id": practice,
+        "practice_stp": np.char.add("E5400", (practice % 42).astype(str)).astype(object),
+        "practice_nuts1_region_name": np.array(REGIONS, dtype=object)[practice % len(REGIONS)],
+    }
+
+
+def addresses_batch(rng, patient_ids):
+    n = len(patient_ids)
+    return {
+        "patient_id": patient_ids,
+        "address_id": patient_ids,
+        "start_date": random_dates(rng, np.datetime64("1990-01-01"), np.datetime64("2020-10-31"), n),
+        "end_date": (np.full(n, STUDY_START), np.zeros(n, dtype=bool)),
+        "address_type": np.ones(n, dtype=np.int64),
+        "rural_urban_classification": rng.integers(1, 9, n),
+        "imd_rounded": rng.integers(0, 329, n) * 100,
+        "msoa_code": np.char.add("E0200", rng.integers(1000, 7999, n).astype(str)).astype(object),
+        "has_postcode": np.ones(n, dtype=bool),
+        "care_home_is_potential_match": rng.random(n) < 0.01,
+        "care_home_requires_nursing": np.zeros(n, dtype=bool),
+        "care_home_does_not_require_nursing": np.zeros(n, dtype=bool),
+    }
+
+
+def clockstops_batch(rng, patient_ids, ortho_share, admitted_share):
+    counts = np.minimum(rng.poisson(0.6, len(patient_ids)), 4)
+    ids = np.repeat(patient_ids, counts)
+    n = len(ids)
+
+    # Clock stops spread either side of the study period; waits are right-skewed
+    end_date = random_dates(rng, np.datetime64("2020-11-01"), np.datetime64("2022-10-31"), n)
+    wait_days = np.clip(rng.lognormal(np.log(100), 0.9, n), 0, 1500).astype(int)
+    start_date = end_date - wait_days.astype("timedelta64[D]")
+    # Week ending on the following Sunday (1970-01-01 was a Thursday)
+    weekday = (end_date.astype(int) + 3) % 7
+    week_ending = end_date + (6 - weekday).astype("timedelta64[D]")
+
+    ortho = rng.random(n) < ortho_share
+    treatment_function = np.where(ortho, "110", rng.choice(OTHER_TREATMENT_FUNCTIONS, n)).astype(object)
+    admitted = rng.random(n) < admitted_share
+    waiting_list_type = np.where(
+        admitted,
+        rng.choice(ADMITTED_TYPES[0], n, p=ADMITTED_TYPES[1]),
+        rng.choice(NOT_ADMITTED_TYPES[0], n, p=NOT_ADMITTED_TYPES[1]),
+    ).astype(object)
+
+    def pseudo_ids(prefix):
+        return np.char.add(prefix, rng.integers(0, 2**40, n).astype(str)).astype(object)
+
+    return {
+        "patient_id": ids,
+        "activity_treatment_function_code": treatment_function,
+        "priority_type_code": rng.choice(PRIORITY_TYPES[0], n, p=PRIORITY_TYPES[1]).astype(object),
+        "pseudo_organisation_code_patient_pathway_identifier_issuer": pseudo_ids("ORG"),
+        "pseudo_patient_pathway_identifier": pseudo_ids("PPI"),
+        "pseudo_referral_identifier": pseudo_ids("REF"),
+        "referral_request_received_date": start_date,
+        "referral_to_treatment_period_end_date": end_date,
+        "referral_to_treatment_period_start_date": start_date,
+        "source_of_referral_for_outpatients": rng.choice(["03", "01", "10", "11"], n).astype(object),
+        "waiting_list_type": waiting_list_type,
+        "week_ending_date": week_ending,
+    }
+
+
+def medications_batch(rng, patient_ids, rx_per_patient):
+    # Half of patients have no prescriptions; the rest have a skewed rate
+    #   with mean rx_per_patient
+    rates = np.where(rng.random(len(patient_ids)) < 0.5, 0, rng.gamma(1.0, rx_per_patient, len(patient_ids)))
+    ids = np.repeat(patient_ids, rng.poisson(rates))
+    n = len(ids)
+    return {
+        "patient_id": ids,
+        "date": random_dates(rng, EVENTS_START, EVENTS_END, n),
+        "dmd_code": codes_from(rng, list(MEDICATION_CLASS_WEIGHTS), list(MEDICATION_CLASS_WEIGHTS.values()), n),
+        "consultation_id": rng.integers(1, 2**40, n),
+    }
+
+
+def clinical_events_batch(rng, patient_ids, events_per_patient):
+    n_patients = len(patient_ids)
+    parts = []
+
+    # Ethnicity - recorded once for most people
+    has_ethnicity = patient_ids[rng.random(n_patients) < 0.8]
+    parts.append((has_ethnicity, codes_from(rng, ["ethnicity_codes_6"], [1], len(has_ethnicity)),
+                  np.datetime64("2000-01-01"), np.datetime64("2020-12-31")))
+
+    # Comorbidities - 1 to 5 records each
+    for codelist_name, prevalence in COMORBIDITY_PREVALENCE.items():
+        with_condition = patient_ids[rng.random(n_patients) < prevalence]
+        ids = np.repeat(with_condition, rng.integers(1, 6, len(with_condition)))
+        parts.append((ids, codes_from(rng, [codelist_name], [1], len(ids)), EVENTS_START, STUDY_END))
+
+    # Background events with codes outside our codelists (for volume)
+    ids = np.repeat(patient_ids, rng.poisson(events_per_patient, n_patients))
+    background = np.char.add("9", rng.integers(10**8, 10**9, len(ids)).astype(str)).astype(object)
+    parts.append((ids, background, EVENTS_START, EVENTS_END))
+
+    ids = np.concatenate([part[0] for part in parts])
+    n = len(ids)
+    return {
+        "patient_id": ids,
+        "date": np.concatenate([random_dates(rng, start, end, len(part_ids)) for part_ids, _, start, end in parts]),
+        "snomedct_code": np.concatenate([codes for _, codes, _, _ in parts]),
+        "ctv3_code": (np.full(n, "", dtype=object), np.zeros(n, dtype=bool)),
+        "numeric_value": (np.zeros(n), np.zeros(n, dtype=bool)),
+        "consultation_id": rng.integers(1, 2**40, n),
+    }
+
+
+def apcs_batch(rng, patient_ids, clockstops):
+    # Most admitted orthopaedic pathways end with a spell around the clock stop
+    admitted = np.isin(clockstops["waiting_list_type"], ADMITTED_TYPES[0])
+    ortho = clockstops["activity_treatment_function_code"] == "110"
+    has_spell = admitted & (rng.random(len(admitted)) < 0.7)
+    pathway_ids = clockstops["patient_id"][has_spell]
+    pathway_admission = (
+        clockstops["referral_to_treatment_period_end_date"][has_spell]
+        + rng.integers(-15, 16, has_spell.sum()).astype("timedelta64[D]")
+    )
+    categories = list(HRG_CATEGORY_WEIGHTS)
+    category_weights = np.array(list(HRG_CATEGORY_WEIGHTS.values()))
+    category = rng.choice(categories, has_spell.sum(), p=category_weights / category_weights.sum())
+    pathway_hrg = np.empty(has_spell.sum(), dtype=object)
+    for name in categories:
+        mask = category == name
+        pool = np.array(codelists.hrg_categories[name], dtype=object)
+        pathway_hrg[mask] = pool[rng.integers(0, len(pool), mask.sum())]
+    # Non-orthopaedic pathways get HRGs outside the orthopaedic chapters
+    other = ~ortho[has_spell]
+    pathway_hrg[other] = np.char.add(np.char.add("FZ", rng.integers(10, 99, other.sum()).astype(str)), "A")
+
+    # Background admissions
+    background_ids = np.repeat(patient_ids, rng.poisson(0.2, len(patient_ids)))
+    background_admission = random_dates(rng, EVENTS_START, EVENTS_END, len(background_ids))
+    background_hrg = np.char.add(np.char.add("WH", rng.integers(10, 99, len(background_ids)).astype(str)), "Z").astype(object)
+
+    ids = np.concatenate([pathway_ids, background_ids])
+    admission = np.concatenate([pathway_admission, background_admission])
+    n = len(ids)
+    missing = np.zeros(n, dtype=bool)
+    empty = np.full(n, "", dtype=object)
+    return {
+        "patient_id": ids,
+        "apcs_ident": rng.integers(1, 2**40, n),
+        "admission_date": admission,
+        "discharge_date": admission + rng.geometric(0.4, n).astype("timedelta64[D]"),
+        "admission_method": rng.choice(["11", "12", "13", "21"], n).astype(object),
+        "discharge_destination": (empty, missing),
+        "patient_classification": rng.choice(["1", "2"], n).astype(object),
+        "spell_core_hrg_sus": np.concatenate([pathway_hrg, background_hrg]),
+        "all_diagnoses": (empty, missing),
+        "primary_diagnosis": (empty, missing),
+        "secondary_diagnosis": (empty, missing),
+        "all_procedures": (empty, missing),
+    }
+
+
+def to_record_batch(columns, schema):
+    """Build a record batch; a column given as (values, valid) has nulls where not valid."""
+    arrays = []
+    for field in schema:
+        column = columns.get(field.name)
+        if column is None:
+            arrays.append(pa.nulls(len(columns["patient_id"]), type=field.type))
+        elif isinstance(column, tuple):
+            values, valid = column
+            arrays.append(pa.array(values, type=field.type, mask=~valid))
+        else:
+            arrays.append(pa.array(column, type=field.type))
+    return pa.record_batch(arrays, schema=schema)
+
+
+def generate(output_dir, n_patients, seed, batch_size, ortho_share, admitted_share,
+             rx_per_patient, events_per_patient):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    schemas = align_with_ehrql(SCHEMAS)
+    writers = {
+        name: pa.ipc.new_file(str(output_dir / f"{name}.arrow"), schema)
+        for name, schema in schemas.items()
+    }
+    rows = dict.fromkeys(schemas, 0)
+
+    try:
+        for batch_start in range(0, n_patients, batch_size):
+            # Seed each batch separately, so batches are independent of each other
+            rng = np.random.default_rng([seed, batch_start])
+            patient_ids = np.arange(batch_start + 1, min(batch_start + batch_size, n_patients) + 1)
+
+            clockstops = clockstops_batch(rng, patient_ids, ortho_share, admitted_share)
+            batches = {
+                "patients": patients_batch(rng, patient_ids),
+                "practice_registrations": registrations_batch(rng, patient_ids),
+                "addresses": addresses_batch(rng, patient_ids),
+                "wl_clockstops": clockstops,
+                "medications": medications_batch(rng, patient_ids, rx_per_patient),
+                "clinical_events": clinical_events_batch(rng, patient_ids, events_per_patient),
+                "apcs": apcs_batch(rng, patient_ids, clockstops),
+            }
+            for name, columns in batches.items():
+                batch = to_record_batch(columns, schemas[name])
+                writers[name].write_batch(batch)
+                rows[name] += batch.num_rows
+
+            print(f"{patient_ids[-1]:,} / {n_patients:,} patients", file=sys.stderr)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    for name, n in rows.items():
+        print(f"{name:<24} {n:>14,} rows")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--output", type=Path, default=Path("dummy/tables"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=100000, help="patients per batch")
+    parser.add_argument("--ortho-share", type=float, default=0.15,
+                        help="share of pathways with treatment function 110")
+    parser.add_argument("--admitted-share", type=float, default=0.4,
+                        help="share of pathways with an admitted waiting list type")
+    parser.add_argument("--rx-per-patient", type=float, default=20,
+                        help="mean prescriptions for the half of people who are prescribed anything")
+    parser.add_argument("--events-per-patient", type=float, default=50,
+                        help="mean background clinical events per person")
+
+    args = parser.parse_args()
+
+    generate(args.output, args.patients, args.seed, args.batch_size, args.ortho_share,
+             args.admitted_share, args.rx_per_patient, args.events_per_patient)
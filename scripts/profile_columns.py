@@ -0,0 +1,145 @@
+###########################################################
+# This script reports how much each column of a dataset
+#   definition costs to extract, e.g.:
+#
+#   python scripts/profile_columns.py analysis/dataset_definition_ortho.py
+#
+# Every column added with `dataset.<name> = ...` or
+#   `dataset.add_column(...)` is extracted on its own (with the
+#   same population), and its time and peak memory are compared
+#   with extracting the population alone.
+# Prints a report sorted by time, and writes it as JSON to
+#   output/profiling/<definition>_columns.json
+#
+# Run from the repository root, after any actions the definition
+#   reads from (e.g. generate_cohort_index for the ortho dataset).
+###########################################################
+
+import json
+import re
+import shlex
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+from benchmark import run_and_measure
+
+
+# Loads the definition with a dataset that only outputs the selected
+#   columns. Other columns are still defined (later columns may be
+#   built from them) but are not extracted.
+WRAPPER = """\
+import runpy
+import sys
+
+import ehrql
+
+sys.path.insert(0, {scripts_dir!r})
+from profile_columns import profiling_dataset_class
+
+ProfilingDataset = profiling_dataset_class({keep!r}, {columns_file!r})
+ehrql.create_dataset = ProfilingDataset
+
+dataset = runpy.run_path({definition!r})["dataset"]
+"""
+
+
+def profiling_dataset_class(keep, columns_file):
+    """A Dataset which only extracts columns in `keep` (None = all), and
+    records every column name, in order, to `columns_file`."""
+    from ehrql import Dataset
+
+    class ProfilingDataset(Dataset):
+        def __setattr__(self, name, value):
+            # ehrQL series carry a query model node; anything else is internal state
+            if name.startswith("_") or not hasattr(value, "_qm_node"):
+                return super().__setattr__(name, value)
+            self.add_column(name, value)
+
+        def add_column(self, column_name, ehrql_query):
+            seen.append(column_name)
+            Path(columns_file).write_text(json.dumps(seen))
+            if keep is None or column_name in keep:
+                super().add_column(column_name, ehrql_query)
+            else:
+                hidden[column_name] = ehrql_query
+
+        def __getattr__(self, name):
+            if name in hidden:
+                return hidden[name]
+            return super().__getattr__(name)
+
+    seen = []
+    hidden = {}
+    return ProfilingDataset
+
+
+def extract(definition, keep, ehrql, user_args, work_dir):
+    """Extract only the `keep` columns, returning the measurements and all column names."""
+    definition = Path(definition).resolve()
+    wrapper = definition.with_name(f".profile_{definition.name}")
+    columns_file = work_dir / "columns.json"
+    output = work_dir / "output.arrow"
+    wrapper.write_text(WRAPPER.format(
+        scripts_dir=str(Path(__file__).resolve().parent),
+        keep=keep,
+        columns_file=str(columns_file),
+        definition=str(definition),
+    ))
+    try:
+        returncode, wall_seconds, peak_rss_mb, stderr = run_and_measure(
+            [*ehrql, "generate-dataset", str(wrapper), "--output", str(output),
+             *(["--", *user_args] if user_args else [])]
+        )
+    finally:
+        wrapper.unlink()
+
+    if returncode != 0:
+        raise RuntimeError(f"Extracting {keep} failed:\n{stderr}")
+
+    return wall_seconds, peak_rss_mb, json.loads(columns_file.read_text())
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("definition")
+    parser.add_argument("--columns", default=".*", help="only profile columns matching this regex")
+    parser.add_argument("--ehrql", default="ehrql", help="command used to run ehrQL")
+    parser.add_argument("--output-dir", type=Path, default=Path("output/profiling"))
+    parser.add_argument("user_args", nargs="*", help="arguments passed to the definition (after --)")
+
+    args = parser.parse_args()
+
+    ehrql = shlex.split(args.ehrql)
+    work_dir = args.output_dir / "tmp"
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    # Population only - the baseline every column is compared with
+    base_seconds, base_rss_mb, all_columns = extract(args.definition, [], ehrql, args.user_args, work_dir)
+
+    results = []
+    for column in [name for name in all_columns if re.fullmatch(args.columns, name)]:
+        wall_seconds, peak_rss_mb, _ = extract(args.definition, [column], ehrql, args.user_args, work_dir)
+        results.append({
+            "column": column,
+            "seconds": round(wall_seconds - base_seconds, 3),
+            "extra_rss_mb": round(peak_rss_mb - base_rss_mb, 1),
+        })
+        print(f"profiled {column}", file=sys.stderr)
+
+    results.sort(key=lambda result: result["seconds"], reverse=True)
+
+    total = sum(max(result["seconds"], 0) for result in results) or 1
+    print(f"Population only: {base_seconds:.1f}s, {base_rss_mb:.0f} MB")
+    print(f"{'column':<32} {'seconds':>9} {'share':>7} {'extra MB':>9}")
+    for result in results:
+        print(f"{result['column']:<32} {result['seconds']:>9.2f} "
+              f"{max(result['seconds'], 0) / total:>7.1%} {result['extra_rss_mb']:>9.0f}")
+
+    report_file = args.output_dir / f"{Path(args.definition).stem}_columns.json"
+    report_file.write_text(json.dumps({
+        "definition": args.definition,
+        "population_only": {"seconds": round(base_seconds, 3), "peak_rss_mb": round(base_rss_mb, 1)},
+        "columns": results,
+    }, indent=2))
+    print(f"Report written to {report_file}")
@@ -0,0 +1,468 @@
+###########################################################
+# This script runs project.yaml actions locally, reusing the
+#   outputs of an earlier run when nothing an action depends
+#   on has changed, e.g.:
+#
+#   python scripts/run_pipeline.py opioid_prescribing
+#
+# Each action is fingerprinted from its run command, the
+#   script it runs, the local modules/R files that script
+#   uses, the codelist CSVs it refers to, any input files in
+#   its arguments and the fingerprints of the actions it needs.
+# Outputs are cached under .cache/actions/ by fingerprint - a
+#   matching fingerprint restores the cached outputs instead
+#   of running the action (a "cache hit").
+#
+# Actions that miss are run with `opensafely exec`, as many
+#   at once as the CPU (--jobs) and memory (--memory-gb) budget
+#   allows, each starting as soon as the actions it needs are
+#   done. Each action's output is written to logs/<action>.log,
+#   and a timing summary with the critical path (the slowest
+#   chain of needs) is printed at the end.
+# Run from the repository root.
+###########################################################
+
+import ast
+import glob
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from pathlib import Path
+
+import yaml
+
+
+CACHE_DIR = Path(".cache") / "actions"
+CODELISTS_MODULE = Path("analysis") / "codelists.py"
+
+# Bump to invalidate every cached output (e.g. if fingerprinting changes)
+FINGERPRINT_VERSION = "1"
+
+
+### project.yaml
+
+def load_actions(project_file="project.yaml"):
+    """Actions in project.yaml: name -> {"run": [...], "needs": [...], "outputs": [...]}."""
+    project = yaml.safe_load(Path(project_file).read_text())
+    actions = {}
+    for name, action in project["actions"].items():
+        actions[name] = {
+            "run": shlex.split(action["run"]),
+            "needs": action.get("needs", []),
+            "outputs": [
+                pattern
+                for outputs in action.get("outputs", {}).values()
+                for pattern in outputs.values()
+            ],
+        }
+    return actions
+
+
+def plan(actions, targets):
+    """The targets and everything they need, each after its needs."""
+    order = []
+    seen = set()
+
+    def visit(name, path=()):
+        if name in path:
+            raise ValueError(f"circular needs: {' -> '.join(path + (name,))}")
+        if name in seen:
+            return
+        for need in actions[name]["needs"]:
+            visit(need, path + (name,))
+        seen.add(name)
+        order.append(name)
+
+    for target in targets:
+        visit(target)
+    return order
+
+
+### Fingerprints
+
+@lru_cache(maxsize=None)
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def codelist_sources():
+    """Codelist name (or helper in codelists.py) -> CSV files it is built from.
+
+    Read from the source of codelists.py (without running it), following
+    derived codelists, class indexes, lists of codelist names and helper
+    functions which refer to codelists by name."""
+    tree = ast.parse(CODELISTS_MODULE.read_text())
+    csv_files = {}
+    refers_to = {}
+    lists = {}
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+            if isinstance(target, ast.Name) and target.id == "CSV_CODELISTS":
+                for name, (filename, *_) in ast.literal_eval(node.value).items():
+                    csv_files[name] = filename
+            elif isinstance(target, ast.Name) and target.id == "DERIVED_CODELISTS":
+                for key, value in zip(node.value.keys, node.value.values):
+                    refers_to[key.value] = ast.literal_eval(value.elts[0])
+            elif isinstance(target, ast.Subscript) and target.value.id == "DERIVED_CODELISTS":
+                # DERIVED_CODELISTS["name"] = (SOURCE_LIST, build)
+                sources = node.value.elts[0]
+                refers_to[target.slice.value] = (
+                    lists.get(sources.id, []) if isinstance(sources, ast.Name) else ast.literal_eval(sources)
+                )
+            elif isinstance(target, ast.Name) and isinstance(node.value, ast.List):
+                try:
+                    value = ast.literal_eval(node.value)
+                except ValueError:
+                    continue
+                if all(isinstance(item, str) for item in value):
+                    lists[target.id] = value
+                    refers_to[target.id] = value
+        elif isinstance(node, ast.FunctionDef) and not node.name.startswith("_"):
+            refers_to[node.name] = [
+                child.value for child in ast.walk(node)
+                if isinstance(child, ast.Constant) and isinstance(child.value, str)
+            ]
+
+    def resolve(name, seen=()):
+        if name in csv_files:
+            return {csv_files[name]}
+        files = set()
+        for source in refers_to.get(name, []):
+            if source not in seen:
+                files |= resolve(source, seen + (name,))
+        return files
+
+    return {name: resolve(name) for name in set(csv_files) | set(refers_to)}
+
+
+def local_module(name, search_dir):
+    """Path of a local module or package imported as `name`, if there is one."""
+    path = search_dir.joinpath(*name.split("."))
+    for candidate in [path.with_suffix(".py"), path / "__init__.py"]:
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def python_dependencies(script, args, search_dir=None):
+    """Local modules used by a Python script, and the names (attributes,
+    string constants and arguments) they could look codelists up by."""
+    search_dir = search_dir or script.parent
+    modules = set()
+    names = set(args)
+    packages = set()
+    to_visit = [script]
+
+    while to_visit:
+        path = to_visit.pop()
+        if path in modules:
+            continue
+        modules.add(path)
+        # codelists.py names every codelist - only what the scripts use counts
+        collect_names = path != CODELISTS_MODULE
+        for node in ast.walk(ast.parse(path.read_text())):
+            imported = []
+            if isinstance(node, ast.Import):
+                imported = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                imported = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+            elif isinstance(node, ast.Attribute) and collect_names:
+                names.add(node.attr)
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str) and collect_names:
+                names.add(node.value)
+            for name in imported:
+                module = local_module(name, search_dir)
+                if module is not None:
+                    to_visit.append(module)
+                    if module.name == "__init__.py":
+                        packages.add(module.parent)
+
+    # Modules in a local package chosen by argument, e.g. --groups medicines
+    #   imports ortho_groups/medicines.py at run time
+    for package in packages:
+        for arg in args:
+            module = package / f"{arg}.py"
+            if module.exists() and module not in modules:
+                package_modules, package_names = python_dependencies(module, [], search_dir)
+                modules |= package_modules
+                names |= package_names
+
+    return modules, names
+
+
+def r_dependencies(script):
+    """R files a script source()s (with or without here())."""
+    files = {script}
+    for call in re.findall(r"source\((here\([^)]*\)|[\"'][^\"']+[\"'])\)", script.read_text()):
+        parts = re.findall(r"[\"']([^\"']+)[\"']", call)
+        path = Path(*parts)
+        if path.exists() and path not in files:
+            files |= r_dependencies(path)
+    return files
+
+
+def fingerprint(action, needs):
+    """Hash of everything the action's outputs depend on.
+
+    `needs` is the (fingerprint, output patterns) of each needed action -
+    their outputs are covered by their fingerprints, so aren't hashed."""
+    run = action["run"]
+    files = set()
+    codelist_files = set()
+    not_inputs = action["outputs"] + [pattern for _, outputs in needs for pattern in outputs]
+
+    for arg in run[1:]:
+        path = Path(arg)
+        if not path.is_file() or any(path.match(pattern) for pattern in not_inputs):
+            continue
+        if path.suffix == ".py":
+            modules, names = python_dependencies(path, run[1:])
+            files |= modules
+            if CODELISTS_MODULE in modules:
+                sources = codelist_sources()
+                for name in names:
+                    codelist_files |= sources.get(name, set())
+        elif path.suffix == ".R":
+            files |= r_dependencies(path)
+        else:
+            files.add(path)
+
+    inputs = {
+        "version": FINGERPRINT_VERSION,
+        "run": run,
+        "files": {str(path): file_hash(path) for path in sorted(files | {Path(f) for f in codelist_files})},
+        "needs": [need_fingerprint for need_fingerprint, _ in needs],
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+### Cache
+
+def cache_entry(name, action_fingerprint):
+    return CACHE_DIR / name / action_fingerprint
+
+
+def is_cached(name, action_fingerprint):
+    return (cache_entry(name, action_fingerprint) / "manifest.json").exists()
+
+
+def restore(name, action_fingerprint):
+    """Copy cached outputs into the workspace (unless already there)."""
+    entry = cache_entry(name, action_fingerprint)
+    manifest_file = entry / "manifest.json"
+    for output, output_hash in json.loads(manifest_file.read_text()).items():
+        if Path(output).exists() and file_hash(output) == output_hash:
+            continue
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(entry / "files" / output, output)
+
+
+def store(name, action, action_fingerprint):
+    """Copy an action's outputs into the cache."""
+    entry = cache_entry(name, action_fingerprint)
+    tmp_entry = entry.with_name(entry.name + ".tmp")
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    manifest = {}
+    for pattern in action["outputs"]:
+        for output in sorted(glob.glob(pattern)):
+            destination = tmp_entry / "files" / output
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(output, destination)
+            manifest[output] = file_hash(output)
+
+    (tmp_entry / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    shutil.rmtree(entry, ignore_errors=True)
+    tmp_entry.rename(entry)
+
+
+### Running
+
+# Rough peak memory (GB) of an action, by image - used to keep concurrent
+#   actions within the memory budget
+ACTION_MEMORY_GB = {"ehrql": 4, "python": 2, "r": 2}
+
+
+def default_memory_gb():
+    # Most of the machine's memory, leaving some for everything else
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3 * 0.8
+
+
+def action_memory_gb(action):
+    return ACTION_MEMORY_GB.get(action["run"][0].split(":")[0], 2)
+
+
+def run_action(action, exec_command, log_file):
+    """Run an action, streaming its stdout and stderr to `log_file`."""
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    with log_file.open("wb") as log:
+        return subprocess.run([*exec_command, *action["run"]], stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def timed_run(action, exec_command, log_file):
+    start = time.perf_counter()
+    returncode = run_action(action, exec_command, log_file)
+    return returncode, time.perf_counter() - start
+
+
+def execute(actions, order, fingerprints, exec_command, jobs, memory_gb, force=False, log_dir=Path("logs")):
+    """Run actions in `order`, starting each as soon as its needs are done,
+    with at most `jobs` actions (and `memory_gb` of estimated memory) at
+    once. Returns name -> (status, seconds); an action which fails stops
+    the actions that need it, but not independent ones."""
+    results = {}
+    pending = list(order)
+    running = {}
+
+    def needs_status(name):
+        statuses = {results[need][0] if need in results else "pending" for need in actions[name]["needs"]}
+        if statuses & {"failed", "skipped"}:
+            return "blocked"
+        return "ready" if statuses <= {"ran", "cached"} else "waiting"
+
+    def start_ready(pool):
+        started = True
+        while started:
+            started = False
+            for name in list(pending):
+                status = needs_status(name)
+                if status == "blocked":
+                    pending.remove(name)
+                    results[name] = ("skipped", 0.0)
+                    print(f"skipped     {name}")
+                    started = True
+                    continue
+                if status != "ready":
+                    continue
+
+                short = fingerprints[name][:12]
+                if not force and is_cached(name, fingerprints[name]):
+                    start = time.perf_counter()
+                    restore(name, fingerprints[name])
+                    pending.remove(name)
+                    results[name] = ("cached", time.perf_counter() - start)
+                    print(f"cache hit   {name:<34} {short}")
+                    started = True
+                    continue
+
+                memory = action_memory_gb(actions[name])
+                used = sum(action_memory_gb(actions[other]) for other in running.values())
+                # Always let one action run, even if it's over the budget on its own
+                if len(running) >= jobs or (running and used + memory > memory_gb):
+                    continue
+
+                pending.remove(name)
+                running[pool.submit(timed_run, actions[name], exec_command, log_dir / f"{name}.log")] = name
+                print(f"running     {name:<34} {short}")
+                started = True
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        start_ready(pool)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, seconds = future.result()
+                if returncode == 0:
+                    store(name, actions[name], fingerprints[name])
+                    results[name] = ("ran", seconds)
+                    print(f"done        {name:<34} {seconds:>8.1f}s")
+                else:
+                    results[name] = ("failed", seconds)
+                    print(f"failed      {name:<34} exit code {returncode}, see {log_dir / name}.log",
+                          file=sys.stderr)
+            start_ready(pool)
+
+    return results
+
+
+def critical_path(actions, results):
+    """The chain of needs with the longest total run time, and that time."""
+    finish = {}
+    previous = {}
+    for name in results:
+        needs = [need for need in actions[name]["needs"] if need in finish]
+        slowest = max(needs, key=finish.get, default=None)
+        finish[name] = results[name][1] + (finish[slowest] if slowest else 0)
+        previous[name] = slowest
+
+    name = max(finish, key=finish.get)
+    path = []
+    while name:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], max(finish.values())
+
+
+def print_summary(actions, results, wall_seconds):
+    print()
+    print(f"{'action':<34} {'status':<8} {'seconds':>9}")
+    for name, (status, seconds) in results.items():
+        print(f"{name:<34} {status:<8} {seconds:>9.1f}")
+
+    path, path_seconds = critical_path(actions, results)
+    total_seconds = sum(seconds for _, seconds in results.values())
+    print()
+    print(f"Wall time {wall_seconds:.1f}s for {total_seconds:.1f}s of actions")
+    print(f"Critical path {path_seconds:.1f}s: {' -> '.join(path)}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("actions", nargs="*", help="actions to run, with everything they need (default: all)")
+    parser.add_argument("--project", default="project.yaml")
+    parser.add_argument("--exec", default="opensafely exec", help="command used to run an action's image")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="most actions to run at once")
+    parser.add_argument("--memory-gb", type=float, default=default_memory_gb(),
+                        help="memory budget for actions running at once")
+    parser.add_argument("--log-dir", type=Path, default=Path("logs"))
+    parser.add_argument("--force", action="store_true", help="run every action, ignoring cached outputs")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would run")
+
+    args = parser.parse_args()
+
+    actions = load_actions(args.project)
+    unknown = [name for name in args.actions if name not in actions]
+    if unknown:
+        parser.error(f"unknown actions: {', '.join(unknown)}")
+
+    # Fingerprints only depend on inputs, so are all known before running anything
+    order = plan(actions, args.actions or list(actions))
+    fingerprints = {}
+    for name in order:
+        action = actions[name]
+        fingerprints[name] = fingerprint(
+            action, [(fingerprints[need], actions[need]["outputs"]) for need in action["needs"]]
+        )
+
+    if args.dry_run:
+        for name in order:
+            status = "cache hit" if not args.force and is_cached(name, fingerprints[name]) else "running"
+            print(f"{status:<11} {name:<34} {fingerprints[name][:12]}")
+        sys.exit(0)
+
+    start = time.perf_counter()
+    results = execute(
+        actions, order, fingerprints, shlex.split(args.exec),
+        jobs=args.jobs, memory_gb=args.memory_gb, force=args.force, log_dir=args.log_dir,
+    )
+    print_summary(actions, results, time.perf_counter() - start)
+
+    if any(status in ("failed", "skipped") for status, _ in results.values()):
+        sys.exit(1)